@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+"""Import time of ecache modules in a fresh interpreter.
+
+    python benchmarks/bench_import.py [-n 10]
+
+Also lists which heavy optional dependencies each import pulled in.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ('ecache.core', 'ecache.db', 'ecache.ext.flask_cache')
+HEAVY = ('meepo', 'gevent', 'redis', 'flask', 'dogpile.cache.backends.redis')
+
+_SCRIPT = """
+import sys, time, json
+start = time.time()
+import %s
+elapsed = time.time() - start
+print(json.dumps([elapsed, [m for m in %r if m in sys.modules]]))
+"""
+
+
+def measure(module, n):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings, loaded = [], []
+    for _ in range(n):
+        out = subprocess.check_output(
+            [sys.executable, '-c', _SCRIPT % (module, HEAVY)], cwd=root)
+        elapsed, loaded = json.loads(out.decode().strip().splitlines()[-1])
+        timings.append(elapsed * 1000)
+    timings.sort()
+    return timings, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=10)
+    args = parser.parse_args()
+
+    for module in MODULES:
+        try:
+            timings, loaded = measure(module, args.n)
+        except subprocess.CalledProcessError:
+            print('%-24s failed to import' % module)
+            continue
+        print('%-24s %8.1f ms  loads: %s' % (
+            module, timings[len(timings) // 2], ', '.join(loaded) or '-'))
+
+
+if __name__ == '__main__':
+    main()
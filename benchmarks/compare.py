@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+"""Compare two result files of ``benchmarks/run.py``.
+
+    python benchmarks/compare.py base.json new.json [--threshold 10]
+
+Exits with status 1 if any benchmark got slower by more than threshold
+percent, so it can gate CI.
+"""
+
+import argparse
+import json
+import sys
+
+
+def _index(report):
+    return {
+        (r['name'], json.dumps(r.get('params'), sort_keys=True)): r
+        for r in report['results'] if 'skipped' not in r
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help="regression threshold in percent")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = _index(json.load(f))
+    with open(args.new) as f:
+        new = _index(json.load(f))
+
+    regressed = False
+    for key in sorted(set(base) & set(new)):
+        before, after = base[key]['median_us'], new[key]['median_us']
+        change = (after - before) / before * 100 if before else 0
+        mark = ''
+        if change > args.threshold:
+            mark, regressed = '  REGRESSION', True
+        print('%-28s %-34s %10.2f -> %10.2f us/op %+7.1f%%%s' % (
+            key[0], key[1], before, after, change, mark))
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of ecache hot paths, offline against SQLite.
+
+    python benchmarks/run.py [-o results.json] [--rounds 5] [--only core]
+
+The cache backend is :class:`ecache.memory.MemoryCacheClient` (flask
+benchmarks use dogpile's memory backend), so numbers measure ecache
+overhead without network cost. The ``import`` suite times imports in a
+fresh interpreter, see ``benchmarks/bench_import.py``. Results are
+written as JSON, compare two runs with ``benchmarks/compare.py``.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ecache.memory import MemoryCacheClient  # noqa
+
+ROWS = 5000
+
+
+def measure(name, params, func, ops, rounds):
+    """Run ``func`` ``rounds`` times, each doing ``ops`` operations."""
+    timings = []
+    for _ in range(rounds):
+        start = time.time()
+        func()
+        timings.append((time.time() - start) / ops * 1e6)
+    return _result(name, params, timings, ops, rounds)
+
+
+def _result(name, params, timings, ops, rounds):
+    timings = sorted(timings)
+    result = {
+        'name': name,
+        'params': params,
+        'ops': ops,
+        'rounds': rounds,
+        'min_us': round(timings[0], 3),
+        'median_us': round(timings[len(timings) // 2], 3),
+    }
+    sys.stderr.write('%-28s %-34s %10.2f us/op\n' % (
+        name, json.dumps(params, sort_keys=True), result['median_us']))
+    return result
+
+
+def _skip(name, exc):
+    sys.stderr.write('%-28s skipped: %s\n' % (name, exc))
+    return {'name': name, 'skipped': str(exc)}
+
+
+def bench_core(rounds):
+    from ecache.core import cache_mixin
+    from ecache.db import model_base
+
+    engine = sa.create_engine('sqlite://')
+    session = scoped_session(sessionmaker(engine))
+    cache = MemoryCacheClient()
+    Base = model_base()
+
+    class User(Base, cache_mixin(cache, session)):
+        __tablename__ = 'bench_user'
+
+        id = sa.Column(sa.Integer, primary_key=True)
+        name = sa.Column(sa.String(32))
+        email = sa.Column(sa.String(64))
+
+    Base.metadata.create_all(engine)
+    engine.execute(User.__table__.insert(), [
+        {'id': i, 'name': 'user%d' % i, 'email': 'user%d@example.com' % i}
+        for i in range(ROWS)])
+    hit_pool = list(range(ROWS // 2))
+    miss_pool = list(range(ROWS // 2, ROWS))
+    User.mset(session.query(User).filter(User.id.in_(hit_pool)).all())
+    session.remove()
+
+    def pick(batch, hit_ratio):
+        hits = int(round(batch * hit_ratio))
+        return random.sample(hit_pool, hits) + \
+            random.sample(miss_pool, batch - hits)
+
+    def reset(pks):
+        # keep the hit ratio stable and the identity map empty
+        cache.delete(*[User.gen_raw_key(pk) for pk in pks
+                       if pk >= ROWS // 2])
+        session.expunge_all()
+
+    results = []
+    for hit_ratio in (0.0, 0.5, 1.0):
+        pks = [pick(1, hit_ratio)[0] for _ in range(200)]
+
+        def run_get():
+            for pk in pks:
+                User.get(pk)
+                reset([pk])
+        results.append(measure('core.get', {'hit_ratio': hit_ratio},
+                               run_get, len(pks), rounds))
+
+        for batch in (10, 100, 1000):
+            batches = [pick(batch, hit_ratio) for _ in range(20)]
+
+            def run_mget():
+                for pks in batches:
+                    User.mget(pks)
+                    reset(pks)
+            results.append(measure(
+                'core.mget', {'batch': batch, 'hit_ratio': hit_ratio},
+                run_mget, len(batches), rounds))
+
+    rawdata = [cache.get(User.gen_raw_key(pk)) for pk in hit_pool[:1000]]
+
+    def run_from_cache():
+        for val in rawdata:
+            User.from_cache(val)
+        session.expunge_all()
+    results.append(measure('core.from_cache', {}, run_from_cache,
+                           len(rawdata), rounds))
+    session.remove()
+    return results
+
+
+def bench_hook(rounds):
+    from ecache.core import cache_mixin
+    from ecache.db import model_base
+
+    results = []
+    for with_hook in (False, True):
+        engine = sa.create_engine('sqlite://')
+        session = scoped_session(sessionmaker(engine))
+        Base = model_base()
+        bases = (Base, cache_mixin(MemoryCacheClient(), session)) \
+            if with_hook else (Base,)
+        Todo = type('Todo', bases, {
+            '__tablename__': 'bench_todo',
+            'id': sa.Column(sa.Integer, primary_key=True),
+            'title': sa.Column(sa.String(64)),
+        })
+        Base.metadata.create_all(engine)
+        engine.execute(Todo.__table__.insert(), [
+            {'id': i, 'title': 'todo%d' % i} for i in range(ROWS)])
+
+        for changed in (1, 10, 100):
+            todos = session.query(Todo).limit(changed).all()
+
+            def run_commit():
+                for n in range(20):
+                    for todo in todos:
+                        todo.title = 'todo%d' % n
+                    session.commit()
+            results.append(measure(
+                'hook.commit_per_row',
+                {'changed_rows': changed, 'hook': with_hook},
+                run_commit, 20 * changed, rounds))
+        session.remove()
+    return results
+
+
+def bench_flask(rounds):
+    from dogpile.cache.region import make_region
+    from flask import Flask
+    from flask_sqlalchemy import SQLAlchemy
+
+    from ecache.ext.flask_cache import CacheableMixin, FromCache, \
+        _key_from_query, query_callable
+
+    regions = {'default': make_region().configure('dogpile.cache.memory')}
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db = SQLAlchemy(app)
+
+    class User(db.Model, CacheableMixin):
+        cache_regions = regions
+        query_class = query_callable(regions)
+
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(32))
+        group = db.Column(db.Integer)
+
+    results = []
+    with app.app_context():
+        db.create_all()
+        db.engine.execute(User.__table__.insert(), [
+            {'id': i, 'name': 'user%d' % i, 'group': i % 50}
+            for i in range(ROWS)])
+
+        for shape in (None, 'user_by_name'):
+            queries = [User.query.options(FromCache(shape=shape)).filter(
+                User.name == 'user%d' % i) for i in range(500)]
+
+            def run_keygen():
+                for q in queries:
+                    _key_from_query(q)
+            results.append(measure('flask.key_from_query',
+                                   {'shape': shape}, run_keygen,
+                                   len(queries), rounds))
+
+        pks = list(range(500))
+
+        def run_cache_key():
+            for pk in pks:
+                User.cache._cache_key(pk)
+        results.append(measure('flask.cache_key', {}, run_cache_key,
+                               len(pks), rounds))
+
+        for cached in (False, True):
+            if cached:
+                list(User.cache.filter(group=1))
+
+            def run_filter():
+                for _ in range(10):
+                    if not cached:
+                        regions['default'].backend._cache.clear()
+                    list(User.cache.filter(group=1))
+                    db.session.expunge_all()
+            results.append(measure('flask.filter', {'cached': cached},
+                                   run_filter, 10, rounds))
+    return results
+
+
+def bench_keygen(rounds):
+    """Cache key of a ``CachingQuery`` built by compiling the statement vs
+    from a template registered under ``FromCache(shape=...)``.
+    """
+    from sqlalchemy.ext.declarative import declarative_base
+
+    from ecache.ext.flask_cache import FromCache, _key_from_query, \
+        query_callable
+
+    Base = declarative_base()
+
+    class User(Base):
+        __tablename__ = 'bench_keygen_user'
+
+        id = sa.Column(sa.Integer, primary_key=True)
+        name = sa.Column(sa.String(32))
+        email = sa.Column(sa.String(64))
+
+    engine = sa.create_engine('sqlite://')
+    session = sessionmaker(engine, query_cls=query_callable({}))()
+
+    results = []
+    for shape in (None, 'user_by_name'):
+        option = FromCache(shape=shape)
+        queries = [session.query(User).options(option).filter(
+            User.name == 'user%d' % i, User.email.like('%@example.com')
+        ).limit(10) for i in range(500)]
+
+        def run_keygen():
+            for q in queries:
+                _key_from_query(q)
+        results.append(measure('keygen.key_from_query', {'shape': shape},
+                               run_keygen, len(queries), rounds))
+    return results
+
+
+def bench_import(rounds):
+    from bench_import import MODULES, measure as measure_import
+
+    results = []
+    for module in MODULES:
+        name = 'import.%s' % module
+        try:
+            timings, _ = measure_import(module, rounds)
+        except subprocess.CalledProcessError as e:
+            results.append(_skip(name, e))
+            continue
+        results.append(_result(name, {}, [t * 1000 for t in timings], 1,
+                               rounds))
+    return results
+
+
+SUITES = {
+    'core': bench_core,
+    'hook': bench_hook,
+    'flask': bench_flask,
+    'keygen': bench_keygen,
+    'import': bench_import,
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip().decode()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', default=None,
+                        help="write JSON results to file, default to stdout")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--only', action='append', choices=sorted(SUITES))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = []
+    for name in args.only or sorted(SUITES):
+        try:
+            results.extend(SUITES[name](args.rounds))
+        except ImportError as e:
+            results.append(_skip(name, e))
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': int(time.time()),
+            'rounds': args.rounds,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import itertools
+import time
 import redis
 
 import sqlalchemy.exc as sa_exc
 from sqlalchemy.orm.util import identity_key
 from sqlalchemy.orm import attributes
 
-from ecache.hook import EventHook
+from ecache.hotkey import HotKeyTracker
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +41,31 @@ class CacheMixinBase(object):
 
     TABLE_CACHE_EXPIRATION_TIME = None
 
+    # Estimated gets per 10 seconds for a row to be served from a local
+    # copy for ``HOT_KEY_TTL`` seconds, hot key detection is off if None.
+    HOT_KEY_THRESHOLD = None
+    HOT_KEY_SAMPLE_RATE = 0.01
+    HOT_KEY_TTL = 1
+
+    _hot_key_trackers = {}
+
+    # Bulk writes touching more rows than this are invalidated by bumping
+    # the table generation, which is part of every key if enabled and is
+    # re-read from cache every ``TABLE_GENERATION_CHECK_INTERVAL`` seconds.
+    BULK_INVALIDATE_LIMIT = 1000
+    TABLE_GENERATION = False
+    TABLE_GENERATION_CHECK_INTERVAL = 1
+
+    _table_generations = {}
+
+    # e.g. ``ecache.ttl.AdaptiveTTL(min_ttl=60, max_ttl=86400)``, TTL of
+    # each row then follows its read and write frequency instead of
+    # ``TABLE_CACHE_EXPIRATION_TIME``.
+    TTL_POLICY = None
+
+    # ``ecache.trace.TraceRecorder`` set by ``ecache.trace.install``
+    _tracer = None
+
     _cache_client = _Failed()
     _db_session = _Failed()
     _update_cache_fail_callback = set()
@@ -58,9 +83,51 @@ class CacheMixinBase(object):
         """Generate raw key without namespace"""
 
         if cls.RAWDATA_VERSION:
-            return "{0}|{1}|{2}".format(
+            key = "{0}|{1}|{2}".format(
                 cls.__tablename__, pk, cls.RAWDATA_VERSION)
-        return "{0}|{1}".format(cls.__tablename__, pk)
+        else:
+            key = "{0}|{1}".format(cls.__tablename__, pk)
+        generation = cls._table_generation()
+        if generation:
+            key = "{0}|g{1}".format(key, generation)
+        return key
+
+    @classmethod
+    def _generation_key(cls):
+        return "{0}|__generation__".format(cls.__tablename__)
+
+    @classmethod
+    def _table_generation(cls):
+        if not cls.TABLE_GENERATION:
+            return None
+        now = time.time()
+        checked = cls._table_generations.get(cls.__tablename__)
+        if checked and checked[0] > now:
+            return checked[1]
+        try:
+            generation = cls._cache_client.get(cls._generation_key())
+        except redis.ConnectionError as e:
+            logger.error(e)
+            generation = checked[1] if checked else None
+        cls._table_generations[cls.__tablename__] = (
+            now + cls.TABLE_GENERATION_CHECK_INTERVAL, generation)
+        return generation
+
+    @classmethod
+    def bump_generation(cls):
+        """Invalidate all cached rows of the table at once.
+
+        Needs ``TABLE_GENERATION`` enabled, other processes see the new
+        generation within ``TABLE_GENERATION_CHECK_INTERVAL`` seconds.
+        """
+        assert cls.TABLE_GENERATION, 'TABLE_GENERATION is not enabled!'
+        generation = "{0:x}".format(int(time.time() * 1000000))
+        cls._cache_client.set(cls._generation_key(), generation, None)
+        cls._table_generations[cls.__tablename__] = (
+            time.time() + cls.TABLE_GENERATION_CHECK_INTERVAL, generation)
+        tracker = cls._hot_key_tracker()
+        if tracker:
+            tracker.clear()
 
     @classmethod
     def pk_name(cls):
@@ -125,10 +192,37 @@ class CacheMixinBase(object):
     def _statsd_incr(cls, key, val=1):
         pass
 
+    @classmethod
+    def _hot_key_tracker(cls):
+        if not cls.HOT_KEY_THRESHOLD:
+            return None
+        tracker = cls._hot_key_trackers.get(cls.__tablename__)
+        if tracker is None:
+            tracker = cls._hot_key_trackers.setdefault(
+                cls.__tablename__,
+                HotKeyTracker(cls.HOT_KEY_THRESHOLD,
+                              sample_rate=cls.HOT_KEY_SAMPLE_RATE,
+                              ttl=cls.HOT_KEY_TTL))
+        return tracker
+
+    @classmethod
+    def hot_keys(cls, n=None):
+        """Get current hot primary keys of this table.
+
+        :return: list of ``(pk, estimated gets per window)``
+        """
+        tracker = cls._hot_key_tracker()
+        return tracker.top(n) if tracker else []
+
     @classmethod
     def flush(cls, ids):
-        keys = itertools.chain(*[
-            cls.gen_raw_key(i) for i in ids])
+        if cls._tracer is not None:
+            cls._tracer.record(cls.__tablename__, 'flush', ids)
+        tracker = cls._hot_key_tracker()
+        if tracker:
+            for i in ids:
+                tracker.evict(i)
+        keys = [cls.gen_raw_key(i) for i in ids]
         cls._cache_client.delete(*keys)
 
     @classmethod
@@ -147,10 +241,28 @@ class CacheMixinBase(object):
                     ident_key in cls._db_session.identity_map:
                 return cls._db_session.identity_map[ident_key]
 
+            if cls.TTL_POLICY:
+                cls.TTL_POLICY.record_reads([pk])
+
+            tracker = cls._hot_key_tracker()
+            if tracker:
+                local_val = tracker.get(pk)
+                if local_val:
+                    cls._statsd_incr('local_hit')
+                    if cls._tracer is not None:
+                        cls._tracer.record(cls.__tablename__, 'get', [pk],
+                                           True)
+                    return cls.from_cache(local_val)
+
             try:
                 cached_val = cls._cache_client.get(cls.gen_raw_key(pk))
+                if cls._tracer is not None:
+                    cls._tracer.record(cls.__tablename__, 'get', [pk],
+                                       bool(cached_val))
                 if cached_val:
                     cls._statsd_incr('hit')
+                    if tracker and tracker.record(pk):
+                        tracker.pin(pk, cached_val)
                     return cls.from_cache(cached_val)
             except redis.ConnectionError as e:
                 logger.error(e)
@@ -175,22 +287,44 @@ class CacheMixinBase(object):
                 for pk in pks:
                     ident_key = identity_key(cls, pk)
                     if ident_key in cls._db_session.identity_map:
-                        objs[pk] = cls._db_session.identity_map[identity_key]
+                        objs[pk] = cls._db_session.identity_map[ident_key]
+
+            if cls.TTL_POLICY:
+                cls.TTL_POLICY.record_reads(set(pks) - set(objs))
+            tracer = cls._tracer
+            if tracer is not None:
+                traced_pks = list(set(pks) - set(objs))
+
+            tracker = cls._hot_key_tracker()
+            if tracker and len(pks) > len(objs):
+                local = {}
+                for pk in set(pks) - set(objs):
+                    local_val = tracker.get(pk)
+                    if local_val:
+                        local[pk] = cls.from_cache(local_val)
+                cls._statsd_incr('local_hit', len(local))
+                objs.update(local)
 
             if len(pks) > len(objs):
                 missed_pks = list(set(pks) - set(objs))
                 vals = cls._cache_client.mget(cls.gen_raw_key(pk)
                                               for pk in missed_pks)
                 if vals:
-                    cached = {
-                        k: cls.from_cache(v)
-                        for k, v in zip(missed_pks, vals)
-                        if v is not None
-                    }
+                    cached = {}
+                    for k, v in zip(missed_pks, vals):
+                        if v is None:
+                            continue
+                        if tracker and tracker.record(k):
+                            tracker.pin(k, v)
+                        cached[k] = cls.from_cache(v)
                     _hit_counts = len(cached)
                     cls._statsd_incr('hit', _hit_counts)
                     objs.update(cached)
 
+            if tracer is not None:
+                tracer.record(cls.__tablename__, 'get', traced_pks,
+                              [pk in objs for pk in traced_pks])
+
         lack_pks = set(pks) - set(objs)
         if lack_pks:
             pk = cls.pk_attribute()
@@ -202,9 +336,9 @@ class CacheMixinBase(object):
 
                 cls._statsd_incr('miss', len(lack_objs))
 
-                objs.update({obj.pk: obj} for obj in lack_objs)
+                objs.update({obj.pk: obj for obj in lack_objs})
             else:
-                logger.warn("No pk found for %s, skip %s" %
+                logger.warn("No pk found for %s, skip %s",
                             cls.__tablename__, lack_pks)
         return objs if as_dict else _dict2list(pks, objs)
 
@@ -220,8 +354,16 @@ class CacheMixinBase(object):
             return
 
         pk_name = cls.pk_name()
-        ttl = expiration_time or cls.TABLE_CACHE_EXPIRATION_TIME
+        ttl = expiration_time
+        if not ttl:
+            ttl = cls.TTL_POLICY.ttl(val[pk_name]) if cls.TTL_POLICY \
+                else cls.TABLE_CACHE_EXPIRATION_TIME
         key = cls.gen_raw_key(val[pk_name])
+        if cls._tracer is not None:
+            cls._tracer.record(cls.__tablename__, 'set', [val[pk_name]])
+        tracker = cls._hot_key_tracker()
+        if tracker:
+            tracker.update(val[pk_name], val)
         return cls._cache_client.set(key, val, ttl)
 
     @classmethod
@@ -231,15 +373,40 @@ class CacheMixinBase(object):
 
         assert isinstance(vals[0], cls)
 
-        ttl = cls.TABLE_CACHE_EXPIRATION_TIME
-        objs = {
-            cls.gen_raw_key(val.pk): val.__rawdata__ for val in vals
-        }
-        return cls._cache_client.mset(objs, expiration_time=ttl)
+        if cls._tracer is not None:
+            cls._tracer.record(cls.__tablename__, 'set',
+                               [val.pk for val in vals])
+        tracker = cls._hot_key_tracker()
+        if tracker:
+            for val in vals:
+                tracker.update(val.pk, val.__rawdata__)
+
+        if cls.TTL_POLICY:
+            # one mset per distinct ttl
+            groups = {}
+            for val in vals:
+                groups.setdefault(cls.TTL_POLICY.ttl(val.pk), []).append(val)
+        else:
+            groups = {cls.TABLE_CACHE_EXPIRATION_TIME: vals}
+
+        results = []
+        for ttl, group in groups.items():
+            objs = {
+                cls.gen_raw_key(val.pk): val.__rawdata__ for val in group
+            }
+            results.append(cls._cache_client.mset(objs, expiration_time=ttl))
+        return all(results)
+
+    @classmethod
+    def _record_writes(cls, pks):
+        if cls.TTL_POLICY:
+            cls.TTL_POLICY.record_writes(pks)
 
 
 def cache_mixin(cache, session):
     """CacheMixin factory"""
+    # meepo is only needed once a mixin with hook is built
+    from ecache.hook import EventHook
 
     hook = EventHook([cache], session)
 
@@ -5,10 +5,9 @@ import uuid
 import random
 import threading
 import contextlib
+import hashlib
 import os
 import time
-import sha
-import gevent
 
 from sqlalchemy import event
 from sqlalchemy.ext.declarative import declarative_base, DeclarativeMeta
@@ -49,14 +48,17 @@ class RoutingSession(Session):
         clock = time.time() * 1000
         address = id(self)
         hash_key = self.hash_key
-        return sha.new('{0}\0{1}\0{2}\0{3}\0{4}'.format(
-            pid, tid, clock, address, hash_key)).hexdigest()[:20]
+        return hashlib.sha1('{0}\0{1}\0{2}\0{3}\0{4}'.format(
+            pid, tid, clock, address, hash_key).encode('utf-8')
+        ).hexdigest()[:20]
 
     def rollback(self):
+        import gevent
         with gevent.Timeout(5):
             super(RoutingSession, self).rollback()
 
     def close(self):
+        import gevent
         current_transactions = tuple()
         if self.transaction is not None:
             current_transactions = self.transaction._iterate_parents()
@@ -145,6 +147,23 @@ def session_stack():
         db_ctx.session_stack -= 1
 
 
+@contextlib.contextmanager
+def master_reads(session):
+    """Route reads of session to master within the block if it is a
+    :class:`RoutingSession`, e.g. for tools writing what they read to
+    cache, a lagging slave would overwrite fresher cached rows.
+    """
+    if not hasattr(session, 'using_bind'):
+        yield session
+        return
+    bind = session._name
+    session.using_bind('master')
+    try:
+        yield session
+    finally:
+        session.using_bind(bind)
+
+
 def close_connections(engines, transactions):
     if engines and transactions:
         for engine in engines:
@@ -159,6 +178,28 @@ def sql_commenter(conn, cursor, statement, params, context, executemany):
     pass
 
 
+def iter_chunks(query, column, chunk_size=1000, start_after=None):
+    """Iterate query in chunks ordered by column, with keyset pagination.
+
+    Each chunk is fetched by ``column > last value``, so walking a big
+    table stays cheap for the database no matter how deep it goes.
+
+    :param column: unique, indexed mapped attribute, usually the pk.
+    :param start_after: resume after this value of column.
+    """
+    while True:
+        q = query
+        if start_after is not None:
+            q = q.filter(column > start_after)
+        chunk = q.order_by(column).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        start_after = getattr(chunk[-1], column.key)
+
+
 class DBManager(object):
     def __init__(self):
         self.session_map = {}
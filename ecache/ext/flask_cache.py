@@ -1,16 +1,30 @@
 # -*- coding: utf-8 -*-
 
+import calendar
+import collections
+import contextlib
+import datetime
 import functools
 import hashlib
+import logging
+import threading
+import uuid
 
 from flask_sqlalchemy import BaseQuery
 from sqlalchemy import event
+from sqlalchemy.sql import sqltypes, visitors
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.orm import Session, object_session
 from sqlalchemy.orm.interfaces import MapperOption
 from sqlalchemy.orm.attributes import get_history
 from sqlalchemy.ext.declarative import declared_attr
-from dogpile.cache.region import make_region
+from dogpile.cache.region import CacheRegion
 from dogpile.cache.api import NO_VALUE
 
+from ecache.ext import request_cache
+
+logger = logging.getLogger(__name__)
+
 
 def md5_key_mangler(key):
     if key.startswith('SELECT '):
@@ -18,15 +32,53 @@ def md5_key_mangler(key):
     return key
 
 
-def memoize(obj):
-    cache = obj.cache = {}
+_kwargs_mark = object()
+
+
+def memoize(obj=None, maxsize=1024):
+    """LRU memoizer keeping at most ``maxsize`` results.
+
+    Arguments are used as key directly, so they need to be hashable,
+    calls with unhashable arguments are not cached. Use as ``@memoize``
+    or ``@memoize(maxsize=...)``, stats are available from
+    ``func.cache_info()``.
+    """
+    if obj is None:
+        return functools.partial(memoize, maxsize=maxsize)
+
+    cache = obj.cache = collections.OrderedDict()
+    lock = threading.Lock()
+    stats = {'hits': 0, 'misses': 0}
 
     @functools.wraps(obj)
     def memoizer(*args, **kwargs):
-        key = str(args) + str(kwargs)
-        if key not in cache:
-            cache[key] = obj(*args, **kwargs)
-        return cache[key]
+        key = args
+        if kwargs:
+            key += (_kwargs_mark,) + tuple(sorted(kwargs.items()))
+        try:
+            with lock:
+                result = cache.pop(key)
+                cache[key] = result
+                stats['hits'] += 1
+            return result
+        except KeyError:
+            pass
+        except TypeError:
+            return obj(*args, **kwargs)
+
+        result = obj(*args, **kwargs)
+        with lock:
+            stats['misses'] += 1
+            cache[key] = result
+            while len(cache) > maxsize:
+                cache.popitem(last=False)
+        return result
+
+    def cache_info():
+        with lock:
+            return dict(stats, size=len(cache), maxsize=maxsize)
+
+    memoizer.cache_info = cache_info
     return memoizer
 
 
@@ -35,31 +87,333 @@ cache_config = {
     'expiration_time': 3600  # 1 hour
 }
 
+
+class LazyRegion(CacheRegion):
+    """Cache region configured on first use instead of at import, so
+    importing this module does not connect to the backend.
+    """
+
+    def __init__(self, config, **kwargs):
+        super(LazyRegion, self).__init__(**kwargs)
+        self._lazy_config = config
+        self._lazy_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # only called for attributes ``configure`` has not set yet
+        if name.startswith(('__', '_lazy')) or \
+                '_lazy_config' not in self.__dict__:
+            raise AttributeError(name)
+        with self._lazy_lock:
+            if '_lazy_config' in self.__dict__:
+                self.configure(**self._lazy_config)
+                del self._lazy_config
+        return getattr(self, name)
+
+
 regions = dict(
-    default=make_region(key_mangler=md5_key_mangler).configure(**cache_config)
+    default=LazyRegion(cache_config, key_mangler=md5_key_mangler)
 )
 
 
+def _table_version_key(table):
+    return 'ecache.table_version:%s' % table
+
+
+def _table_versions(region, tables):
+    """Current version tokens of tables, missing ones are created."""
+    keys = [_table_version_key(t) for t in tables]
+    versions = region.get_multi(keys, ignore_expiration=True)
+    missing = {k: uuid.uuid4().hex
+               for k, v in zip(keys, versions) if v is NO_VALUE}
+    if missing:
+        region.set_multi(missing)
+    return tuple(missing.get(k, v) for k, v in zip(keys, versions))
+
+
+def bump_table_version(region, *tables):
+    """Invalidate all query results tagged with tables in region."""
+    region.set_multi({_table_version_key(t): uuid.uuid4().hex
+                      for t in tables})
+
+
+def _real_transaction(transaction):
+    """Closest transaction that commits or rolls back on its own, the
+    outermost one or a savepoint.
+    """
+    while transaction is not None and transaction._parent is not None \
+            and not transaction.nested:
+        transaction = transaction._parent
+    return transaction
+
+
+class _PendingFlush(object):
+    """Cache invalidations collected during a unit of work.
+
+    Deletes, table version bumps and index updates are deduplicated per
+    region and kept per transaction. They are sent once the outermost
+    transaction commits, a committed savepoint hands them over to its
+    parent, and a transaction ending otherwise drops them.
+    """
+
+    session_key = 'ecache.pending_flush'
+
+    def __init__(self):
+        self.keys = {}
+        self.tables = {}
+        self.index_ops = {}
+
+    @classmethod
+    def of(cls, obj):
+        """Pending flush of the transaction obj is written in, ``None`` if
+        obj is detached or its session has no transaction.
+        """
+        session = object_session(obj)
+        transaction = _real_transaction(
+            session.transaction if session is not None else None)
+        if transaction is None:
+            return None
+        pendings = session.info.setdefault(cls.session_key, {})
+        pending = pendings.get(transaction)
+        if pending is None:
+            pending = pendings[transaction] = cls()
+        return pending
+
+    def merge(self, other):
+        for region, keys in other.keys.values():
+            self.keys.setdefault(id(region), (region, set()))[1].update(keys)
+        for region, tables in other.tables.values():
+            self.tables.setdefault(id(region), (region, set()))[1].update(
+                tables)
+        for client, ops in other.index_ops.values():
+            self.index_ops.setdefault(id(client), (client, []))[1].extend(
+                ops)
+
+    def delete(self, region, key):
+        self.keys.setdefault(id(region), (region, set()))[1].add(key)
+
+    def bump(self, region, table):
+        self.tables.setdefault(id(region), (region, set()))[1].add(table)
+
+    def index(self, client, name, *args):
+        self.index_ops.setdefault(id(client), (client, []))[1].append(
+            (name, args))
+
+    def execute(self):
+        """Send the invalidations. The database has committed already, so
+        a failed step is logged and the others still run.
+        """
+        for region, keys in self.keys.values():
+            try:
+                region.delete_multi(list(keys))
+            except Exception:
+                logger.exception("Error deleting %d cache keys", len(keys))
+        for region, tables in self.tables.values():
+            for table in tables:
+                request_cache.invalidate(table)
+            try:
+                bump_table_version(region, *tables)
+            except Exception:
+                logger.exception("Error bumping versions of tables %s",
+                                 ', '.join(sorted(tables)))
+        for client, ops in self.index_ops.values():
+            try:
+                pipe = client.pipeline(transaction=False)
+                for name, args in ops:
+                    getattr(pipe, name)(*args)
+                pipe.execute()
+            except Exception:
+                logger.exception("Error updating %d cache list index entries",
+                                 len(ops))
+
+
+def _session_commit(session):
+    transaction = _real_transaction(session.transaction)
+    pendings = session.info.get(_PendingFlush.session_key)
+    pending = pendings.pop(transaction, None) if pendings else None
+    if pending is None:
+        return
+    if transaction.nested:
+        parent = _real_transaction(transaction._parent)
+        pendings.setdefault(parent, _PendingFlush()).merge(pending)
+    else:
+        pending.execute()
+
+
+def _session_transaction_end(session, transaction):
+    # rolled back or closed without commit
+    pendings = session.info.get(_PendingFlush.session_key)
+    if pendings:
+        pendings.pop(transaction, None)
+
+
 class CachingQuery(BaseQuery):
 
     def __init__(self, regions, entities, *args, **kwargs):
         self.cache_regions = regions
-        super(CachingQuery, self).__init__(entities=entities, *args, **kwargs)
+        super(CachingQuery, self).__init__(entities, *args, **kwargs)
 
     def __iter__(self):
         if hasattr(self, '_cache_region'):
-            return self.get_value(
-                createfunc=lambda: list(super(CachingQuery, self).__iter__()))
+            if self._cache_region.chunk_size:
+                return self._iter_chunked(self._cache_region.chunk_size)
+            if self._cache_region.normalized:
+                row_cache = self._row_cache()
+                if row_cache is not None:
+                    return self._iter_normalized(row_cache)
+            return iter(self.get_value(
+                createfunc=lambda: list(super(CachingQuery, self).__iter__())))
         else:
             return super(CachingQuery, self).__iter__()
 
+    def _row_cache(self):
+        """Per-row :class:`Cache` of the queried model, if any."""
+        if len(self._entities) != 1:
+            return None
+        entity = self.column_descriptions[0]['type']
+        row_cache = getattr(entity, 'cache', None)
+        return row_cache if isinstance(row_cache, Cache) else None
+
+    def _iter_normalized(self, row_cache):
+        """Cache only the pk list of the result, rows are resolved
+        through the per-row cache with one multi-get.
+        """
+        dogpile_region, cache_key, tables = self._get_cache_key_tables()
+        loaded = []
+
+        def createfunc():
+            loaded.extend(super(CachingQuery, self).__iter__())
+            row_cache.set_multi(loaded)
+            return [getattr(o, row_cache.pk) for o in loaded]
+
+        pks = self._get_or_create(dogpile_region, cache_key, createfunc,
+                                  self._tags(tables))
+        if loaded:
+            return iter(loaded)
+        objs = [o for o in row_cache.get_multi(pks) if o is not None]
+        return iter(self.merge_result(objs, load=False))
+
     def _get_cache_plus_key(self):
-        dogpile_region = self.cache_regions[self._cache_region.region]
-        if self._cache_region.cache_key:
-            key = self._cache_region.cache_key
+        dogpile_region, cache_key, _ = self._get_cache_key_tables()
+        return dogpile_region, cache_key
+
+    def _get_cache_key_tables(self):
+        """Region, cache key and names of tables the query reads.
+
+        Tables are found in the statement built for the key and memoized
+        per shape or compiled SQL, so a cache hit builds the statement
+        once. For an explicit cache key they are only looked up when the
+        value is tagged.
+        """
+        cache_region = self._cache_region
+        dogpile_region = self.cache_regions[cache_region.region]
+        if cache_region.cache_key:
+            key = cache_region.cache_key
+            tables = ()
+            if cache_region.tag_tables:
+                template = ('cache_key', key)
+                tables = _table_tags.get(template) or _statement_tables(
+                    self.with_labels().statement, template)
+        else:
+            stmt = self.with_labels().statement
+            key, template = _statement_key(stmt, cache_region.shape)
+            tables = _statement_tables(stmt, template)
+        return dogpile_region, key, tables
+
+    def _tags(self, tables):
+        """Tables to tag the cached value with, empty if tagging is off."""
+        return tables if self._cache_region.tag_tables else ()
+
+    def _iter_chunked(self, chunk_size):
+        """Stream the result from fixed-size chunks under derived keys.
+
+        The main key holds a manifest with the id of the fill and the
+        number of chunks, which is written after all chunks, so a
+        partially consumed result is never visible as cached. Chunk keys
+        include the fill id, so a concurrent, older fill can't overwrite
+        chunks a newer manifest points at, the chunks of the manifest a
+        fill replaces are deleted. Only one chunk is held in memory at a
+        time. If a chunk was evicted while reading, the rest of the result
+        is read from database, so the query should have a stable order.
+        """
+        dogpile_region, cache_key, tables = self._get_cache_key_tables()
+        tables = self._tags(tables)
+
+        def chunk_key(fill, i):
+            return '%s:chunk:%s:%d' % (cache_key, fill, i)
+
+        yielded = 0
+        manifest = self._get_or_create(dogpile_region, cache_key, None,
+                                       tables)
+        if isinstance(manifest, tuple):
+            fill, count = manifest
+            for i in range(count):
+                chunk = dogpile_region.get(chunk_key(fill, i))
+                if chunk is NO_VALUE:
+                    break
+                for obj in self.merge_result(chunk, load=False):
+                    yield obj
+                    yielded += 1
+            else:
+                return
+
+        versions = _table_versions(dogpile_region, tables) if tables else None
+        fill = uuid.uuid4().hex
+        chunk, count = [], 0
+        for i, obj in enumerate(super(CachingQuery, self).__iter__()):
+            chunk.append(obj)
+            if len(chunk) == chunk_size:
+                dogpile_region.set(chunk_key(fill, count), chunk)
+                chunk, count = [], count + 1
+            if i >= yielded:
+                yield obj
+        if chunk:
+            dogpile_region.set(chunk_key(fill, count), chunk)
+            count += 1
+        manifest = (fill, count)
+        replaced = dogpile_region.get(cache_key, ignore_expiration=True)
+        dogpile_region.set(
+            cache_key, manifest if versions is None else (versions, manifest))
+
+        # stored as (versions, manifest) if tagged
+        if tables and isinstance(replaced, tuple):
+            replaced = replaced[1]
+        if isinstance(replaced, tuple) and replaced[0] != fill:
+            old_fill, old_count = replaced
+            dogpile_region.delete_multi(
+                [chunk_key(old_fill, i) for i in range(old_count)])
+
+    def _get_or_create(self, dogpile_region, cache_key, createfunc, tables,
+                       expiration_time=None, ignore_expiration=False):
+        """Get value from region, validated against versions of tables.
+
+        Tagged values are stored as ``(versions, value)``, a value whose
+        versions are outdated is treated as a miss.
+        """
+        if not tables:
+            if ignore_expiration or not createfunc:
+                return dogpile_region.get(
+                    cache_key, expiration_time=expiration_time,
+                    ignore_expiration=ignore_expiration)
+            return dogpile_region.get_or_create(
+                cache_key, createfunc, expiration_time=expiration_time)
+
+        versions = _table_versions(dogpile_region, tables)
+        if ignore_expiration or not createfunc:
+            cached_value = dogpile_region.get(
+                cache_key, expiration_time=expiration_time,
+                ignore_expiration=ignore_expiration)
         else:
-            key = _key_from_query(self)
-        return dogpile_region, key
+            cached_value = dogpile_region.get_or_create(
+                cache_key, lambda: (versions, createfunc()),
+                expiration_time=expiration_time)
+
+        if isinstance(cached_value, tuple) and cached_value[0] == versions:
+            return cached_value[1]
+        if not createfunc:
+            return NO_VALUE
+        value = createfunc()
+        dogpile_region.set(cache_key, (versions, value))
+        return value
 
     def invalidated(self):
         dogpile_region, cache_key = self._get_cache_plus_key()
@@ -67,52 +421,182 @@ class CachingQuery(BaseQuery):
 
     def get_value(self, merge=True, createfunc=None, expiration_time=None,
                   ignore_expiration=False):
-        dogpile_region, cache_key = self._get_cache_plus_key()
+        dogpile_region, cache_key, tables = self._get_cache_key_tables()
 
         assert not ignore_expiration or not createfunc, \
             "Can't ignore expiration and also provide createfunc"
 
-        if ignore_expiration or not createfunc:
-            cached_value = dogpile_region.get(
-                cache_key, expiration_time=expiration_time,
-                ignore_expiration=ignore_expiration)
-        else:
-            cached_value = dogpile_region.get_or_create(
-                cache_key, createfunc, expiration_time=expiration_time)
+        # explicit keys are per-row entries, memoized by ``Cache.get``
+        memo = None
+        if not self._cache_region.cache_key:
+            memo = request_cache.current()
+        if memo is not None:
+            memo_key = ('query', self._cache_region.region, cache_key, merge)
+            cached_value = memo.get(tables[0] if tables else None, memo_key,
+                                    NO_VALUE)
+            if cached_value is not NO_VALUE:
+                return cached_value
+
+        cached_value = self._get_or_create(
+            dogpile_region, cache_key, createfunc, self._tags(tables),
+            expiration_time=expiration_time,
+            ignore_expiration=ignore_expiration)
 
         if cached_value is NO_VALUE:
             raise KeyError(cache_key)
         if merge:
             cached_value = self.merge_result(cached_value, load=False)
 
+        if memo is not None:
+            cached_value = list(cached_value)
+            memo.set(tables, memo_key, cached_value)
         return cached_value
 
     def set_value(self, value):
-        dogpile_region, cache_key = self._get_cache_plus_key()
+        dogpile_region, cache_key, tables = self._get_cache_key_tables()
+        tables = self._tags(tables)
+        if tables:
+            value = (_table_versions(dogpile_region, tables), value)
         dogpile_region.set(cache_key, value)
 
 
+# Add ``member`` to sorted set only if the index was built already, a
+# missing index is rebuilt from database on the next read.
+_ZADD_IF_EXISTS = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('zadd', KEYS[1], ARGV[1], ARGV[2])
+end
+return 0
+"""
+
+# Member kept in every built index so empty results are cached too.
+_INDEX_MARKER = ''
+
+# Column types ``_index_score`` can turn into a sorted set score.
+_SCORE_TYPES = (sqltypes.Numeric, sqltypes.Integer, sqltypes.Date,
+                sqltypes.DateTime)
+
+
+def _index_score(value):
+    if value is None:
+        return 0
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple()) + \
+            value.microsecond / 1e6
+    if isinstance(value, datetime.date):
+        return value.toordinal()
+    return float(value)
+
+
 def query_callable(regions, query_cls=CachingQuery):
     return functools.partial(query_cls, regions)
 
 
-def _key_from_query(query, qualifier=None):
-    stmt = query.with_labels().statement
+# ``(shape, number of bind values)`` -> key prefix of compiled statement
+_key_templates = {}
+# shape, compiled SQL or explicit cache key -> names of tables read
+_table_tags = {}
+_TABLE_TAGS_MAX = 4096
+
+
+def _bind_values(stmt):
+    values = []
+
+    def visit_bindparam(bind):
+        values.append(bind.effective_value)
+
+    visitors.traverse(stmt, {}, {'bindparam': visit_bindparam})
+    values.append(getattr(stmt, '_limit', None))
+    values.append(getattr(stmt, '_offset', None))
+    return values
+
+
+def _bind_bytes(value):
+    if not isinstance(value, (bytes, type(u''))):
+        value = str(value)
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+def _key_from_template(stmt, shape):
+    """Build cache key of a statement whose structure is named ``shape``.
+
+    The statement is compiled only the first time a shape is seen, later
+    keys are made from the precomputed prefix and the bound values, which
+    are collected by walking the statement instead of compiling it.
+    """
+    values = _bind_values(stmt)
+    template_key = (shape, len(values))
+    prefix = _key_templates.get(template_key)
+    if prefix is None:
+        prefix = '%s:%s' % (shape, hashlib.md5(
+            str(stmt.compile()).encode('utf-8')).hexdigest())
+        prefix = _key_templates.setdefault(template_key, prefix)
+    params = hashlib.md5()
+    for value in values:
+        value = _bind_bytes(value)
+        # length prefixed, so values containing separators can't collide
+        params.update(('%d:' % len(value)).encode('ascii') + value)
+    return '%s:%s' % (prefix, params.hexdigest())
+
+
+def _statement_key(stmt, shape=None):
+    """Cache key of stmt and the template its structure is known by,
+    ``shape`` if given, else the compiled SQL.
+    """
+    if shape:
+        return _key_from_template(stmt, shape), shape
+
     compiled = stmt.compile()
+    sql = str(compiled)
     params = compiled.params
 
-    return ' '.join(
-        [str(compiled)] + [str(params[k]) for k in sorted(params)]
-    )
+    return ' '.join([sql] + [str(params[k]) for k in sorted(params)]), sql
+
+
+def _statement_tables(stmt, template):
+    """Names of tables read by stmt, memoized per template."""
+    tables = _table_tags.get(template)
+    if tables is None:
+        tables = tuple(sorted(set(t.name for t in find_tables(stmt))))
+        if len(_table_tags) >= _TABLE_TAGS_MAX:
+            _table_tags.clear()
+        _table_tags[template] = tables
+    return tables
+
+
+def _key_from_query(query, qualifier=None):
+    cache_region = getattr(query, '_cache_region', None)
+    shape = cache_region.shape if cache_region is not None else None
+    return _statement_key(query.with_labels().statement, shape)[0]
 
 
 class FromCache(MapperOption):
 
     propagate_to_loaders = False
 
-    def __init__(self, region='default', cache_key=None):
+    def __init__(self, region='default', cache_key=None, shape=None,
+                 normalized=False, tag_tables=True, chunk_size=None):
+        """
+        :param shape: name for the structure of the query, queries sharing
+                      a shape must only differ in bound values, their keys
+                      are then built without compiling SQL on every call.
+        :param normalized: cache only the pk list of the result and share
+                           row entries with ``Model.cache``, works for
+                           queries of a single :class:`CacheableMixin` model.
+        :param tag_tables: validate the result against versions of the
+                           tables it reads, writes through
+                           :class:`CacheableMixin` bump those versions.
+        :param chunk_size: store the result in chunks of this many rows and
+                           stream it back chunk by chunk, for large results.
+        """
         self.region = region
         self.cache_key = cache_key
+        self.shape = shape
+        self.normalized = normalized
+        self.tag_tables = tag_tables
+        self.chunk_size = chunk_size
 
     def process_query(self, query):
         query._cache_region = self
@@ -124,79 +608,277 @@ class Cache(object):
         self.regions = regions
         self.label = label
         self.pk = getattr(model, 'cache_pk', 'id')
+        self.order_by = getattr(model, 'cache_order_by', None) or self.pk
+        self.indexes = [tuple(sorted(attrs)) for attrs in
+                        getattr(model, 'cache_list_indexes', ())]
+        if self.indexes:
+            order_type = getattr(model, self.order_by).type
+            if not isinstance(order_type, _SCORE_TYPES):
+                raise TypeError(
+                    '%s.%s is %r, `cache_order_by` needs a numeric, date or '
+                    'datetime column' % (model.__name__, self.order_by,
+                                         order_type))
 
     def get(self, pk):
-        return self.model.query.options(self.from_cache(pk=pk)).get(pk)
+        memo = request_cache.current()
+        table = self.model.__table__.name
+        if memo is not None:
+            obj = memo.get(table, ('get', pk), NO_VALUE)
+            if obj is not NO_VALUE:
+                return obj
+
+        obj = self.model.query.options(self.from_cache(pk=pk)).get(pk)
+        if memo is not None:
+            memo.set([table], ('get', pk), obj)
+        return obj
 
     def filter(self, order_by='asc', offset=None, limit=None, **kwargs):
-        query_kwargs = {}
-        if kwargs:
-            if len(kwargs) > 1:
-                raise TypeError(
-                    'filter accept only one attribute for filtering')
-            key, value = kwargs.items()[0]
+        memo = request_cache.current()
+        if memo is None:
+            return self._filter(order_by, offset, limit, **kwargs)
+
+        table = self.model.__table__.name
+        memo_key = ('filter', order_by, offset, limit,
+                    tuple(sorted(kwargs.items())))
+        objs = memo.get(table, memo_key)
+        if objs is None:
+            objs = list(self._filter(order_by, offset, limit, **kwargs))
+            memo.set([table], memo_key, objs)
+        return iter(objs)
+
+    def _filter(self, order_by='asc', offset=None, limit=None, **kwargs):
+        for key in kwargs:
             if key not in self._columns():
                 raise TypeError(
                     '%s does not have an attribute %s' % (self, key))
-            query_kwargs[key] = value
+
+        if tuple(sorted(kwargs)) in self.indexes:
+            pks = self._index_pks(kwargs, order_by == 'desc', offset, limit)
+            for obj in self.get_multi(pks):
+                if obj is not None:
+                    yield obj
+            return
+
+        if len(kwargs) > 1:
+            raise TypeError(
+                'filter on multiple attributes needs a `cache_list_indexes`'
+                ' entry for %s' % ', '.join(sorted(kwargs)))
 
         cache_key = self._cache_key(**kwargs)
-        pks = self.regions[self.label].get(cache_key)
+        region = self.regions[self.label]
+        pks = region.get(cache_key)
 
         if pks is NO_VALUE:
             pks = [
-                o.id for o in self.model.query.filter_by(
+                o[0] for o in self.model.query.filter_by(
                     **kwargs).with_entities(getattr(self.model, self.pk))]
+            region.set(cache_key, pks)
 
         if order_by == 'desc':
-            pks.reverse()
+            pks = pks[::-1]
 
         if offset is not None:
-            pks = pks[pks:]
+            pks = pks[offset:]
 
         if limit is not None:
             pks = pks[:limit]
 
-        keys = [self._cache_key(pk) for pk in pks]
-        for pos, obj in enumerate(self.regions[self.label].get_multi(keys)):
-            if obj is NO_VALUE:
-                yield self.get(pks[pos])
-            else:
-                yield obj[0]
+        for obj in self.get_multi(pks):
+            if obj is not None:
+                yield obj
+
+    def get_multi(self, pks):
+        """Get objects by pks in order, ``None`` for missing rows.
+
+        Cache misses are loaded with one ``IN`` query and written back with
+        one ``set_multi``. The ``[]`` that :meth:`get` caches for a missing
+        row counts as a miss.
+        """
+        if not pks:
+            return []
+        region = self.regions[self.label]
+        objs = [o[0] if o is not NO_VALUE and o else None for o in
+                region.get_multi([self._cache_key(pk) for pk in pks])]
+
+        missing = [pk for pk, obj in zip(pks, objs) if obj is None]
+        if missing:
+            pk_attr = getattr(self.model, self.pk)
+            loaded = {getattr(o, self.pk): o for o in
+                      self.model.query.filter(pk_attr.in_(missing))}
+            self.set_multi(loaded.values())
+            objs = [loaded.get(pk) if obj is None else obj
+                    for pk, obj in zip(pks, objs)]
+        return objs
+
+    def set_multi(self, objs):
+        """Write objects to their per-row entries with one ``set_multi``."""
+        if objs:
+            self.regions[self.label].set_multi(
+                {self._cache_key(getattr(o, self.pk)): [o] for o in objs})
 
     def flush(self, key):
         self.regions[self.label].delete(key)
 
-    @memoize
+    def _index_client(self):
+        return getattr(self.regions[self.label].backend, 'client', None)
+
+    def _index_key(self, **kwargs):
+        q_filter = '&'.join('%s=%s' % (k, kwargs[k]) for k in sorted(kwargs))
+        return "ecache.index:%s.%s" % (self.model.__table__, q_filter)
+
+    def _pk_from_member(self, member):
+        if isinstance(member, bytes) and not isinstance(member, str):
+            member = member.decode('utf-8')
+        try:
+            python_type = getattr(self.model, self.pk).type.python_type
+        except NotImplementedError:
+            return member
+        return python_type(member)
+
+    def _index_pks(self, kwargs, desc, offset, limit):
+        """Get a page of pks from the sorted set index of ``kwargs``.
+
+        Members are pks scored by ``cache_order_by`` column, the index is
+        built from database on first use.
+        """
+        client = self._index_client()
+        order_column = getattr(self.model, self.order_by)
+        if client is None:
+            query = self.model.query.filter_by(**kwargs).order_by(
+                order_column.desc() if desc else order_column)
+            query = query.with_entities(getattr(self.model, self.pk))
+            return [o[0] for o in query.offset(offset).limit(limit)]
+
+        key = self._index_key(**kwargs)
+        start = offset or 0
+        end = start + limit - 1 if limit else -1
+        if not desc:
+            # skip the marker, it always scores lowest
+            start, end = start + 1, end + 1 if limit else -1
+
+        pipe = client.pipeline()
+        pipe.exists(key)
+        if desc:
+            pipe.zrevrange(key, start, end)
+        else:
+            pipe.zrange(key, start, end)
+        exists, members = pipe.execute()
+
+        if not exists:
+            rows = self.model.query.filter_by(**kwargs).with_entities(
+                getattr(self.model, self.pk), order_column).all()
+            self._build_index(client, key, rows)
+            rows.sort(key=lambda r: _index_score(r[1]), reverse=desc)
+            members = [r[0] for r in rows]
+            return members[offset:][:limit] if limit else members[offset:]
+
+        return [self._pk_from_member(m) for m in members
+                if m not in (_INDEX_MARKER, b'')]
+
+    def _build_index(self, client, key, rows):
+        args = ['-inf', _INDEX_MARKER]
+        for pk, order_value in rows:
+            args.extend((_index_score(order_value), pk))
+        pipe = client.pipeline()
+        pipe.delete(key)
+        pipe.execute_command('ZADD', key, *args)
+        expiration_time = self.regions[self.label].expiration_time
+        if expiration_time and expiration_time > 0:
+            pipe.expire(key, expiration_time)
+        pipe.execute()
+
+    def _update_indexes(self, obj, op):
+        """Keep sorted set indexes in step with a written row.
+
+        :param op: one of ``insert``, ``update`` and ``delete``
+        """
+        with self._pending_flush(obj) as pending:
+            self._collect_index_ops(obj, op, pending)
+
+    def _collect_index_ops(self, obj, op, pending):
+        client = self._index_client() if self.indexes else None
+        if client is None:
+            return
+
+        new, old = {}, {}
+        for attr in set(a for attrs in self.indexes for a in attrs) | \
+                set([self.order_by]):
+            added, unchanged, deleted = get_history(obj, attr)
+            new[attr] = getattr(obj, attr)
+            old[attr] = (list(deleted) or list(unchanged) or [new[attr]])[0]
+
+        if op == 'update' and old == new:
+            return
+
+        pk = getattr(obj, self.pk)
+        score = _index_score(new[self.order_by])
+        for attrs in self.indexes:
+            old_key = self._index_key(**{a: old[a] for a in attrs})
+            new_key = self._index_key(**{a: new[a] for a in attrs})
+            if op == 'delete' or (op == 'update' and old_key != new_key):
+                pending.index(client, 'zrem', old_key, pk)
+            if op != 'delete':
+                pending.index(client, 'eval', _ZADD_IF_EXISTS, 1, new_key,
+                              score, pk)
+
+    @memoize(maxsize=256)
     def _columns(self):
         return [
             c.name for c in self.model.__table__.columns if c.name != self.pk]
 
-    @memoize
-    def from_cache(self, cachel_key=None, pk=None):
+    @memoize(maxsize=8192)
+    def from_cache(self, cache_key=None, pk=None):
         if pk:
             cache_key = self._cache_key(pk)
-        return FromCache(self.label, cache_key)
+        # row entries are flushed by key, no need to tag them
+        return FromCache(self.label, cache_key, tag_tables=False)
 
-    @memoize
+    @memoize(maxsize=8192)
     def _cache_key(self, pk='all', **kwargs):
         q_filter = ''.join('%s=%s' % (k, v) for k, v in kwargs.items()) \
             or self.pk
         return "%s.%s[%s]" % (self.model.__table__, q_filter, pk)
 
+    @contextlib.contextmanager
+    def _pending_flush(self, obj):
+        """Collect invalidations for obj, they are sent after its session
+        commits, or right away if obj is not in a session.
+        """
+        pending = _PendingFlush.of(obj)
+        if pending is not None:
+            yield pending
+        else:
+            pending = _PendingFlush()
+            yield pending
+            pending.execute()
+
     def _flush_all(self, obj):
-        for column in self._columns():
-            added, unchanged, deleted = get_history(obj, column)
-            for value in list(deleted) + list(added):
-                self.flush(self._cache_key(**{column: value}))
-        self.flush(self._cache_key())
-        self.flush(self._cache_key(getattr(obj, self.pk)))
+        request_cache.invalidate(self.model.__table__.name)
+        with self._pending_flush(obj) as pending:
+            region = self.regions[self.label]
+            for column in self._columns():
+                added, unchanged, deleted = get_history(obj, column)
+                for value in list(deleted) + list(added):
+                    pending.delete(region, self._cache_key(**{column: value}))
+            pending.delete(region, self._cache_key())
+            pk = getattr(obj, self.pk)
+            if pk is not None:
+                pending.delete(region, self._cache_key(pk))
+            # query results may live in any region the model knows about
+            for r in self.regions.values():
+                pending.bump(r, self.model.__table__.name)
 
 
 class CacheableMixin(object):
     cache_label = 'default'
     cache_regions = regions
 
+    # Attribute combinations whose pk lists are kept in redis sorted sets,
+    # e.g. ``(('user_id',), ('status', 'city'))``, ordered by
+    # ``cache_order_by`` column, default to the pk.
+    cache_list_indexes = ()
+    cache_order_by = None
+
     @declared_attr
     def cache(cls):
         return Cache(cls, cls.cache_regions, cls.cache_label)
@@ -205,8 +887,33 @@ class CacheableMixin(object):
     def _flush_event(mapper, connection, target):
         target.cache._flush_all(target)
 
+    @staticmethod
+    def _index_insert_event(mapper, connection, target):
+        target.cache._update_indexes(target, 'insert')
+
+    @staticmethod
+    def _index_update_event(mapper, connection, target):
+        target.cache._update_indexes(target, 'update')
+
+    @staticmethod
+    def _index_delete_event(mapper, connection, target):
+        target.cache._update_indexes(target, 'delete')
+
     @classmethod
     def __declare_last__(cls):
-        event.listen(cls, 'before_delete', cls._flush_event)
-        event.listen(cls, 'before_update', cls._flush_event)
-        event.listen(cls, 'before_insert', cls._flush_event)
+        # may run again for the same class, e.g. when more mappers are
+        # configured later, listeners must be added once
+        if not event.contains(Session, 'after_commit', _session_commit):
+            event.listen(Session, 'after_commit', _session_commit)
+            event.listen(Session, 'after_transaction_end',
+                         _session_transaction_end)
+        listeners = [('before_delete', cls._flush_event),
+                     ('before_update', cls._flush_event),
+                     ('before_insert', cls._flush_event)]
+        if cls.cache_list_indexes:
+            listeners += [('after_insert', cls._index_insert_event),
+                          ('after_update', cls._index_update_event),
+                          ('after_delete', cls._index_delete_event)]
+        for identifier, fn in listeners:
+            if not event.contains(cls, identifier, fn):
+                event.listen(cls, identifier, fn)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+  Request scoped memo in front of :mod:`ecache.ext.flask_cache` lookups.
+
+  Enable it per app::
+
+      from ecache.ext import request_cache
+
+      request_cache.init_app(app)
+
+  Within an app context, repeated ``Model.cache.get``, ``Model.cache.filter``
+  and cached query lookups are then served from ``flask.g`` instead of
+  going to the cache server again.
+"""
+
+import logging
+
+from flask import current_app, g, has_app_context
+
+logger = logging.getLogger(__name__)
+
+_EXTENSION_NAME = 'ecache_request_cache'
+_G_ATTR = '_ecache_request_cache'
+
+
+class RequestCache(object):
+    """Memo of cache lookups, entries are grouped by table so a write to a
+    table drops everything read from it.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, table, key, default=None):
+        entries = self.tables.get(table)
+        if entries is None or key not in entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entries[key]
+
+    def set(self, tables, key, value):
+        for table in tables:
+            self.tables.setdefault(table, {})[key] = value
+
+    def invalidate(self, table):
+        entries = self.tables.pop(table, None)
+        if entries:
+            self.invalidations += 1
+            # entries of multi table queries are stored under every table
+            for key in entries:
+                for other in self.tables.values():
+                    other.pop(key, None)
+
+    def summary(self):
+        """Round trips saved in current request, for debugging."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'round_trips_saved': self.hits,
+        }
+
+
+def init_app(app):
+    app.extensions[_EXTENSION_NAME] = True
+    app.teardown_appcontext(_teardown)
+
+
+def current():
+    """Request cache of current app context, ``None`` if not enabled."""
+    if not has_app_context() or \
+            not current_app.extensions.get(_EXTENSION_NAME):
+        return None
+    cache = getattr(g, _G_ATTR, None)
+    if cache is None:
+        cache = RequestCache()
+        setattr(g, _G_ATTR, cache)
+    return cache
+
+
+def invalidate(table):
+    cache = current()
+    if cache is not None:
+        cache.invalidate(table)
+
+
+def _teardown(exc):
+    cache = getattr(g, _G_ATTR, None)
+    if cache is None:
+        return
+    delattr(g, _G_ATTR)
+    logger.debug("ecache request cache summary: %s", cache.summary())
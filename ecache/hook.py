@@ -3,6 +3,13 @@
 import logging
 import itertools
 
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.dml import Delete
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, \
+    BooleanClauseList, ClauseList, Grouping
+
 try:
     from meepo.signals import signal
 except ImportError:
@@ -15,17 +22,69 @@ See: https://github.com/eleme/meepo.
 from meepo.apps.eventsourcing import sqlalchemy_es_pub
 
 
+def _is_column(clause, column):
+    return getattr(clause, 'key', None) == column.key and \
+        getattr(clause, 'table', None) is column.table
+
+
+def _pks_from_criterion(criterion, pk_column):
+    """Primary keys a where clause is restricted to, ``None`` if unknown.
+
+    Understands ``pk == x``, ``pk.in_(...)`` and ``and_``/``or_`` of them.
+    """
+    if isinstance(criterion, BooleanClauseList):
+        results = [_pks_from_criterion(c, pk_column)
+                   for c in criterion.clauses]
+        if criterion.operator is operators.and_:
+            known = [r for r in results if r is not None]
+            return min(known, key=len) if known else None
+        if criterion.operator is operators.or_ and None not in results:
+            return set().union(*results)
+        return None
+
+    if isinstance(criterion, BinaryExpression) and \
+            _is_column(criterion.left, pk_column) and \
+            criterion.operator in (operators.eq, operators.in_op):
+        return _bind_values(criterion.right)
+    return None
+
+
+def _bind_values(clause):
+    """Values of a literal right side, ``None`` for anything else, e.g.
+    columns, functions or subqueries.
+    """
+    if isinstance(clause, BindParameter):
+        return set([clause.effective_value])
+    if isinstance(clause, Grouping):
+        clause = clause.element
+    if isinstance(clause, ClauseList) and \
+            all(isinstance(c, BindParameter) for c in clause.clauses):
+        return set(c.effective_value for c in clause.clauses)
+    return None
+
+
+def _criterion_columns(criterion):
+    return set(getattr(c, 'key', None) for c in visitors.iterate(criterion, {})
+               if hasattr(c, 'table'))
+
+
 class EventHook(sqlalchemy_es_pub):
 
     def __init__(self, cache_clients, session, tables=None):
         super(EventHook, self).__init__(session, tables)
 
         self.cache_clients = cache_clients
+        self.models = {}
         self.logger = logging.getLogger(__name__)
 
+        event.listen(session, 'after_bulk_update', self.session_bulk_update)
+        event.listen(session, 'after_bulk_delete', self.session_bulk_delete)
+        event.listen(Engine, 'before_execute', self.engine_before_execute)
+
     def add(self, model):
         tablename = model.__tablename__
         self.tables.add(tablename)
+        self.models[tablename] = model
 
         self.install_cache_signal(tablename)
 
@@ -44,11 +103,13 @@ class EventHook(sqlalchemy_es_pub):
         tablename = model.__tablename__
         pk = raw_obj[pk_name]
 
+        model._record_writes([pk])
         model.set_raw(raw_obj)
 
         self.logger.info("set raw data cache for {} {}".format(tablename, pk))
 
     def _delete_sub(self, obj):
+        obj._record_writes([obj.pk])
         obj.flush([obj.pk])
 
         self.logger.info("delete cache for {} {}".format(
@@ -69,16 +130,133 @@ class EventHook(sqlalchemy_es_pub):
 
             session.pending_rawdata[key] = obj.__rawdata__, obj.__class__
 
+    def engine_before_execute(self, conn, clauseelement, multiparams, params):
+        """Select pks of rows a bulk DELETE of a hooked table is about to
+        remove, unless its criterion restricts pks already.
+
+        Rows are gone once ``after_bulk_delete`` fires, the pks are kept
+        on the connection for :meth:`_collect_bulk`.
+        """
+        if not isinstance(clauseelement, Delete):
+            return
+        model = self.models.get(clauseelement.table.name)
+        if model is None:
+            return
+        pk_column = model.pk_attribute().property.columns[0]
+        criterion = clauseelement._whereclause
+        if criterion is not None and \
+                _pks_from_criterion(criterion, pk_column) is not None:
+            return
+
+        limit = model.BULK_INVALIDATE_LIMIT
+        query = select([pk_column]).limit(limit + 1)
+        if criterion is not None:
+            query = query.where(criterion)
+        rows = conn.execute(query, *multiparams, **params).fetchall()
+        pks = set(row[0] for row in rows) if len(rows) <= limit else None
+        conn.info['ecache.bulk_delete'] = clauseelement, pks
+
+    def session_bulk_update(self, update_context):
+        self._collect_bulk(update_context, update_context.values)
+
+    def session_bulk_delete(self, delete_context):
+        self._collect_bulk(delete_context)
+
+    def _collect_bulk(self, context, values=None):
+        """Record rows touched by ``Query.update()``/``Query.delete()``.
+
+        Pks come from the rows synchronize_session='fetch' pre-selected,
+        else from a pk restriction in the criteria, else from selecting
+        rows matching it, capped by ``BULK_INVALIDATE_LIMIT``: before the
+        statement runs for deletes, see :meth:`engine_before_execute`,
+        after it for updates not changing columns of the criteria. If all
+        fail, the table generation is bumped on commit.
+        """
+        table = context.primary_table.name
+        model = self.models.get(table)
+        if model is None:
+            return
+
+        pk_column = model.pk_attribute().property.columns[0]
+        criterion = context.query.whereclause
+        matched_rows = getattr(context, 'matched_rows', None)
+        selected = self._selected_for_delete(context) \
+            if values is None else None
+        if matched_rows is not None:
+            pks = set(row[0] for row in matched_rows)
+        elif selected is not None:
+            pks = selected[1]
+        elif criterion is None:
+            pks = None
+        else:
+            pks = _pks_from_criterion(criterion, pk_column)
+            changed = set(getattr(k, 'key', k) for k in values or ())
+            if pks is None and values is not None and \
+                    not changed & _criterion_columns(criterion):
+                limit = model.BULK_INVALIDATE_LIMIT
+                rows = context.session.query(pk_column).filter(
+                    criterion).limit(limit + 1).all()
+                if len(rows) <= limit:
+                    pks = set(row[0] for row in rows)
+
+        if not hasattr(context.session, 'pending_bulk'):
+            context.session.pending_bulk = {}
+        pending = context.session.pending_bulk
+        if pks is None or pending.get(table, set()) is None:
+            pending[table] = None
+        else:
+            pending.setdefault(table, set()).update(pks)
+
+    @staticmethod
+    def _selected_for_delete(context):
+        result = getattr(context, 'result', None)
+        if result is None:
+            return None
+        info = result.context.root_connection.info
+        selected = info.pop('ecache.bulk_delete', None)
+        if selected is None or \
+                selected[0] is not result.context.compiled.statement:
+            return None
+        return selected
+
+    def _flush_bulk(self, pending_bulk):
+        for table, pks in pending_bulk.items():
+            model = self.models[table]
+            limit = model.BULK_INVALIDATE_LIMIT
+            if pks is not None and (len(pks) <= limit or
+                                    not model.TABLE_GENERATION):
+                pks = list(pks)
+                model._record_writes(pks)
+                for i in range(0, len(pks), limit):
+                    model.flush(pks[i:i + limit])
+                self.logger.info("delete cache for {} rows of {}".format(
+                    len(pks), table))
+            elif model.TABLE_GENERATION:
+                model.bump_generation()
+                self.logger.info("bump cache generation of {}".format(table))
+            else:
+                self.logger.warn(
+                    "bulk write to {} touched unknown rows, enable "
+                    "TABLE_GENERATION to invalidate them".format(table))
+
     def session_commit(self, session):
         if hasattr(session, 'pending_rawdata'):
             self._pub_cache_events("rawdata", session.pending_rawdata)
 
+        if getattr(session, 'pending_bulk', None):
+            self._flush_bulk(session.pending_bulk)
+        if hasattr(session, 'pending_bulk'):
+            del session.pending_bulk
+
         super(EventHook, self).session_commit(session)
 
     def session_rollback(self, session):
         if hasattr(session, 'pending_rawdata'):
             del session.pending_rawdata
 
+        if hasattr(session, 'pending_bulk'):
+            del session.pending_bulk
+
         super(EventHook, self).session_rollback(session)
 
     def _pub_cache_events(self, event_type, objs):
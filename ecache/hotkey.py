@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+
+
+class SpaceSaving(object):
+    """Space-saving top-K counter.
+
+    Keeps at most ``capacity`` counters, a new key replaces the smallest
+    one and inherits its count, so heavy hitters are never underestimated.
+    The inherited count is kept as the error of the counter, a key was
+    seen at least ``count - error`` times.
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, key, n=1):
+        if key in self.counts:
+            self.counts[key] += n
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = n
+            self.errors[key] = 0
+        else:
+            victim = min(self.counts, key=self.counts.get)
+            error = self.counts.pop(victim)
+            del self.errors[victim]
+            self.counts[key] = error + n
+            self.errors[key] = error
+        return self.counts[key]
+
+    def guaranteed(self, key):
+        """Lower bound of the count of key."""
+        return self.counts.get(key, 0) - self.errors.get(key, 0)
+
+    def decay(self, factor=0.5):
+        self.counts = {k: c * factor for k, c in self.counts.items()
+                       if c * factor >= 1}
+        self.errors = {k: self.errors[k] * factor for k in self.counts}
+
+    def top(self, n=None):
+        items = sorted(self.counts.items(), key=lambda i: i[1], reverse=True)
+        return items[:n] if n else items
+
+
+class HotKeyTracker(object):
+    """Detect hot keys by sampling accesses and keep a local copy of them.
+
+    :param threshold: accesses per ``window`` seconds for a key to be pinned
+                      locally, counted without the error inherited from
+                      evicted counters, so cold keys never qualify.
+    :param sample_rate: fraction of accesses fed into the counter.
+    :param capacity: number of keys tracked by the top-K counter.
+    :param ttl: seconds a pinned copy is served before going back to cache.
+    :param window: counters are halved every ``window`` seconds.
+    """
+
+    def __init__(self, threshold, sample_rate=0.01, capacity=64, ttl=1,
+                 window=10):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.ttl = ttl
+        self.window = window
+        self.counter = SpaceSaving(capacity)
+        self._pinned = {}
+        self._lock = threading.Lock()
+        self._decay_at = time.time() + window
+
+    def record(self, key):
+        """Sample an access of key, return whether key is hot now."""
+        if random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            now = time.time()
+            if now >= self._decay_at:
+                self.counter.decay()
+                self._decay_at = now + self.window
+            self.counter.add(key)
+            count = self.counter.guaranteed(key)
+        return count / self.sample_rate >= self.threshold
+
+    def get(self, key):
+        item = self._pinned.get(key)
+        if item is None:
+            return None
+        expire_at, val = item
+        if expire_at < time.time():
+            self._pinned.pop(key, None)
+            return None
+        return val
+
+    def pin(self, key, val):
+        with self._lock:
+            if len(self._pinned) >= self.counter.capacity:
+                now = time.time()
+                self._pinned = {k: v for k, v in self._pinned.items()
+                                if v[0] >= now and k in self.counter.counts}
+                if len(self._pinned) >= self.counter.capacity:
+                    return
+            self._pinned[key] = (time.time() + self.ttl, val)
+
+    def update(self, key, val):
+        """Refresh the local copy of key if it is pinned."""
+        if key in self._pinned:
+            self.pin(key, val)
+
+    def evict(self, key):
+        self._pinned.pop(key, None)
+
+    def clear(self):
+        self._pinned.clear()
+
+    def top(self, n=None):
+        """Current top keys with estimated accesses per window."""
+        with self._lock:
+            return [(k, int(c / self.sample_rate))
+                    for k, c in self.counter.top(n)]
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+_STAT_NAMES = ('hits', 'misses', 'sets', 'deletes', 'evictions', 'expired')
+
+
+class _Stripe(object):
+
+    def __init__(self, max_bytes, stats=False):
+        self.lock = threading.Lock()
+        self.data = collections.OrderedDict()
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.stats = dict.fromkeys(_STAT_NAMES, 0) if stats else None
+
+    def _incr(self, name):
+        if self.stats is not None:
+            self.stats[name] += 1
+
+    def _pop(self, key):
+        _, blob = self.data.pop(key)
+        self.size -= len(blob)
+
+    def get(self, key, now):
+        item = self.data.get(key)
+        if item is None:
+            self._incr('misses')
+            return None
+        expire_at, blob = item
+        if expire_at and expire_at <= now:
+            self._pop(key)
+            self._incr('expired')
+            self._incr('misses')
+            return None
+        # move to the most recently used end
+        del self.data[key]
+        self.data[key] = item
+        self._incr('hits')
+        return blob
+
+    def set(self, key, blob, expire_at):
+        if key in self.data:
+            self._pop(key)
+        if len(blob) > self.max_bytes:
+            return False
+        self.data[key] = (expire_at, blob)
+        self.size += len(blob)
+        self._incr('sets')
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self.data)))
+            self._incr('evictions')
+        return True
+
+    def delete(self, key):
+        if key not in self.data:
+            return 0
+        self._pop(key)
+        self._incr('deletes')
+        return 1
+
+
+class MemoryCacheClient(object):
+    """In-process cache client.
+
+    Implements the client interface used by :class:`ecache.core.CacheMixinBase`
+    and :class:`ecache.hook.EventHook`, so it can replace a redis client in
+    tests, single process tools and benchmarks::
+
+        CacheMixin = cache_mixin(MemoryCacheClient(), DBSession)
+
+    Values are stored pickled, so callers never share objects with the
+    cache, and the pickled size is what counts against ``max_bytes``.
+    Keys are spread over ``stripes`` independently locked LRU segments,
+    each holding at most ``max_bytes / stripes`` bytes.
+
+    :param max_bytes: memory cap for stored values, default to 64MB.
+    :param stripes: number of lock stripes.
+    :param stats: whether to count hits, misses, evictions etc.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, stripes=16, stats=False):
+        assert stripes > 0, 'stripes should be positive!'
+        self.max_bytes = max_bytes
+        self.record_stats = stats
+        self._stripes = [_Stripe(max_bytes // stripes, stats)
+                         for _ in range(stripes)]
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    @staticmethod
+    def _expire_at(expiration_time):
+        return time.time() + expiration_time if expiration_time else None
+
+    def _set(self, key, val, expire_at):
+        blob = pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+        stripe = self._stripe(key)
+        with stripe.lock:
+            return stripe.set(key, blob, expire_at)
+
+    def get(self, key):
+        stripe = self._stripe(key)
+        with stripe.lock:
+            blob = stripe.get(key, time.time())
+        if blob is None:
+            return None
+        return pickle.loads(blob)
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, val, expiration_time=None):
+        return self._set(key, val, self._expire_at(expiration_time))
+
+    def mset(self, mapping, expiration_time=None):
+        expire_at = self._expire_at(expiration_time)
+        return all([self._set(key, val, expire_at)
+                    for key, val in mapping.items()])
+
+    def delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            stripe = self._stripe(key)
+            with stripe.lock:
+                deleted += stripe.delete(key)
+        return deleted
+
+    def clear(self):
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.data.clear()
+                stripe.size = 0
+
+    def __len__(self):
+        return sum(len(stripe.data) for stripe in self._stripes)
+
+    @property
+    def size(self):
+        """Bytes of pickled values currently stored."""
+        return sum(stripe.size for stripe in self._stripes)
+
+    def stats(self):
+        """Aggregated counters, empty if created with ``stats=False``."""
+        if not self.record_stats:
+            return {}
+        stats = dict.fromkeys(_STAT_NAMES, 0)
+        for stripe in self._stripes:
+            for name, val in stripe.stats.items():
+                stats[name] += val
+        stats.update(items=len(self), bytes=self.size)
+        return stats
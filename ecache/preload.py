@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+  Warm up the cache of a model built with :func:`ecache.core.cache_mixin`.
+
+  From python::
+
+      from ecache.preload import preload
+
+      preload(TodoListModel, chunk_size=2000, rate=10000,
+              criterion=TodoListModel.updated_at > yesterday)
+
+  From shell::
+
+      ecache-preload myapp.models:TodoListModel --rate 10000 \\
+          --checkpoint /tmp/todo_list.ckpt --where "updated_at > '2016-01-01'"
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import time
+
+import sqlalchemy as sa
+
+from ecache.db import iter_chunks, master_reads
+
+logger = logging.getLogger(__name__)
+
+
+def _load_checkpoint(path, table):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('table') != table:
+        raise ValueError("checkpoint %s is for table %s, not %s" % (
+            path, data.get('table'), table))
+    return data.get('last_pk')
+
+
+def _save_checkpoint(path, table, last_pk):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'table': table, 'last_pk': last_pk}, f)
+    os.rename(tmp, path)
+
+
+def preload(model, chunk_size=1000, rate=None, checkpoint=None,
+            criterion=None, start_after=None):
+    """Stream rows of model in pk order and write the uncached ones to
+    cache.
+
+    Rows are read from master with keyset pagination, the session is
+    closed after each chunk so no transaction is held open across the
+    whole run. Rows already in cache are left alone, they may have been
+    written by a hook after the chunk was read.
+
+    :param chunk_size: rows per query and per ``mset``.
+    :param rate: max rows read per second, no limit if None.
+    :param checkpoint: file to record the last written pk in, preloading
+                       resumes from it if it exists, it's removed once all
+                       rows are written.
+    :param criterion: optional filter, e.g. ``Model.updated_at > since``.
+    :param start_after: only preload rows with pk greater than this.
+    :return: number of rows written to cache
+    """
+    pk = model.pk_attribute()
+    assert pk is not None, 'No pk found for %s' % model.__tablename__
+
+    resumed = _load_checkpoint(checkpoint, model.__tablename__)
+    if resumed is not None:
+        start_after = resumed
+        logger.info("resume preloading %s after %s",
+                    model.__tablename__, resumed)
+
+    count = written = 0
+    started = time.time()
+    with master_reads(model._db_session()) as session:
+        query = session.query(model)
+        if criterion is not None:
+            query = query.filter(criterion)
+        try:
+            for objs in iter_chunks(query, pk, chunk_size, start_after):
+                # end the read transaction before writing to cache
+                session.close()
+                written += _set_missing(model, objs)
+                count += len(objs)
+
+                if checkpoint:
+                    _save_checkpoint(checkpoint, model.__tablename__,
+                                     objs[-1].pk)
+                logger.info("preloaded %d of %d rows of %s, last pk %s",
+                            written, count, model.__tablename__,
+                            objs[-1].pk)
+
+                if rate:
+                    delay = started + float(count) / rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+        finally:
+            session.close()
+
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return written
+
+
+def _set_missing(model, objs):
+    cached = model._cache_client.mget(
+        [model.gen_raw_key(obj.pk) for obj in objs])
+    missing = [obj for obj, val in zip(objs, cached or [None] * len(objs))
+               if val is None]
+    model.mset(missing)
+    return len(missing)
+
+
+def _import_model(path):
+    module_name, _, name = path.partition(':')
+    if not name:
+        raise ValueError("model should be given as `module:Model`")
+    return getattr(importlib.import_module(module_name), name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Preload cache of a model built with ecache.")
+    parser.add_argument('model', help="model path, e.g. `myapp.models:User`")
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=None,
+                        help="max rows per second")
+    parser.add_argument('--checkpoint', default=None,
+                        help="file to resume from and record progress in")
+    parser.add_argument('--where', default=None,
+                        help="SQL filter, e.g. \"updated_at > '2016-01-01'\"")
+    parser.add_argument('--start-after', default=None,
+                        help="only preload rows with greater pk")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    model = _import_model(args.model)
+    criterion = sa.text(args.where) if args.where else None
+    count = preload(model, chunk_size=args.chunk_size, rate=args.rate,
+                    checkpoint=args.checkpoint, criterion=criterion,
+                    start_after=args.start_after)
+    logger.info("done, %d rows of %s preloaded", count, model.__tablename__)
+
+
+if __name__ == '__main__':
+    main()
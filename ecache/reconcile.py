@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+  Find and fix cache entries that drifted from database.
+
+  Missed hook events (bulk ``query.update()``, raw SQL, crashes between
+  commit and cache update) leave stale rows in cache until they expire.
+  The reconciler walks a table in pk order, fetches the cached rows of
+  each batch with one ``mget`` and compares them with database rows::
+
+      from ecache.reconcile import reconcile
+
+      stats = reconcile(TodoListModel, mode='evict',
+                        updated_column='updated_at', since=last_run)
+"""
+
+import argparse
+import logging
+
+from ecache.db import iter_chunks, master_reads
+from ecache.preload import _import_model
+
+logger = logging.getLogger(__name__)
+
+MODES = ('report', 'evict', 'repair')
+
+
+def _repair(model, session, drifted):
+    """Re-read drifted rows from master, write those still drifted and
+    unchanged since the batch was read, evict the others.
+    """
+    pk = model.pk_attribute()
+    rows = {o.pk: o.__rawdata__ for o in drifted}
+    fresh = session.query(model).populate_existing() \
+        .filter(pk.in_(list(rows))).all()
+    session.close()
+    fresh = {obj.pk: obj for obj in fresh}
+
+    cached = model._cache_client.mget([model.gen_raw_key(p) for p in rows])
+    confirmed, evicted = [], []
+    for p, val in zip(rows, cached or [None] * len(rows)):
+        obj = fresh.get(p)
+        if val is None or obj is not None and val == obj.__rawdata__:
+            # expired or updated by a hook meanwhile
+            continue
+        elif obj is not None and obj.__rawdata__ == rows[p]:
+            confirmed.append(obj)
+        else:
+            evicted.append(p)
+    if confirmed:
+        model.mset(confirmed)
+    if evicted:
+        model.flush(evicted)
+    return len(confirmed) + len(evicted)
+
+
+def reconcile(model, mode='report', batch_size=500, updated_column=None,
+              since=None, start_after=None):
+    """Compare cached rows of model with database and fix drifted ones.
+
+    Rows are read from master, the transaction is ended after each batch.
+
+    :param mode: ``report`` only counts, ``evict`` deletes drifted entries,
+                 ``repair`` re-reads drifted rows and overwrites the cache
+                 with those still drifted, rows changed meanwhile are
+                 evicted instead.
+    :param updated_column: name of an ``updated_at``-like column, with
+                           ``since`` only rows updated since then are checked.
+    :param start_after: only check rows with pk greater than this.
+    :return: drift statistics, ``last_updated`` is the max value of
+             ``updated_column`` seen, usable as ``since`` of the next run.
+    """
+    assert mode in MODES, 'mode should be one of %s' % ', '.join(MODES)
+    pk = model.pk_attribute()
+    assert pk is not None, 'No pk found for %s' % model.__tablename__
+
+    stats = dict(scanned=0, cached=0, matched=0, drifted=0, fixed=0,
+                 last_updated=None)
+
+    # a lagging slave would report fresh cache as drifted
+    with master_reads(model._db_session()) as session:
+        query = session.query(model).populate_existing()
+        if updated_column and since is not None:
+            query = query.filter(getattr(model, updated_column) >= since)
+        try:
+            for objs in iter_chunks(query, pk, batch_size, start_after):
+                session.close()
+                _reconcile_batch(model, session, mode, objs, updated_column,
+                                 stats)
+        finally:
+            session.close()
+    return stats
+
+
+def _reconcile_batch(model, session, mode, objs, updated_column, stats):
+    cached = model._cache_client.mget(
+        [model.gen_raw_key(obj.pk) for obj in objs])
+
+    drifted = []
+    for obj, val in zip(objs, cached or [None] * len(objs)):
+        if updated_column:
+            updated = getattr(obj, updated_column)
+            if stats['last_updated'] is None or \
+                    updated > stats['last_updated']:
+                stats['last_updated'] = updated
+        if val is None:
+            continue
+        stats['cached'] += 1
+        if val == obj.__rawdata__:
+            stats['matched'] += 1
+        else:
+            drifted.append(obj)
+
+    stats['scanned'] += len(objs)
+    stats['drifted'] += len(drifted)
+    if drifted:
+        logger.info("%d drifted rows of %s: %s", len(drifted),
+                    model.__tablename__, [o.pk for o in drifted])
+        if mode == 'repair':
+            stats['fixed'] += _repair(model, session, drifted)
+        elif mode == 'evict':
+            model.flush([o.pk for o in drifted])
+            stats['fixed'] += len(drifted)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reconcile cache of a model built with ecache with db.")
+    parser.add_argument('model', help="model path, e.g. `myapp.models:User`")
+    parser.add_argument('--mode', choices=MODES, default='report')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--updated-column', default=None,
+                        help="updated_at-like column for incremental runs")
+    parser.add_argument('--since', default=None,
+                        help="only check rows updated since, needs "
+                             "--updated-column")
+    parser.add_argument('--start-after', default=None,
+                        help="only check rows with greater pk")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    model = _import_model(args.model)
+    stats = reconcile(model, mode=args.mode, batch_size=args.batch_size,
+                      updated_column=args.updated_column, since=args.since,
+                      start_after=args.start_after)
+    logger.info("%s: %s", model.__tablename__, stats)
+
+
+if __name__ == '__main__':
+    main()
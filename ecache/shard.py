@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import hashlib
+import logging
+import os
+import struct
+import threading
+
+from multiprocessing.dummy import Pool as ThreadPool
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value):
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    return struct.unpack('>I', hashlib.md5(value).digest()[:4])[0]
+
+
+class HashRing(object):
+    """Consistent hash ring with virtual nodes.
+
+    Every node is placed on the ring ``replicas`` times, so adding or
+    removing one of N nodes only moves about 1/N of the keys.
+    """
+
+    def __init__(self, nodes=(), replicas=160):
+        self.replicas = replicas
+        self._points = []
+        self._owners = {}
+        for node in nodes:
+            self.add_node(node)
+
+    def __len__(self):
+        return len(set(self._owners.values()))
+
+    def add_node(self, node):
+        for i in range(self.replicas):
+            point = _hash("{0}#{1}".format(node, i))
+            if point in self._owners:
+                continue
+            bisect.insort(self._points, point)
+            self._owners[point] = node
+
+    def remove_node(self, node):
+        points = [p for p, n in self._owners.items() if n == node]
+        for point in points:
+            del self._owners[point]
+            del self._points[bisect.bisect_left(self._points, point)]
+
+    def get_node(self, key):
+        if not self._points:
+            raise LookupError("hash ring is empty")
+        idx = bisect.bisect(self._points, _hash(key))
+        if idx == len(self._points):
+            idx = 0
+        return self._owners[self._points[idx]]
+
+
+class ShardedCacheClient(object):
+    """Spread cache keys across several cache clients.
+
+    Implements the client interface :class:`ecache.core.CacheMixinBase`
+    relies on, so it can be passed to :func:`ecache.core.cache_mixin`::
+
+        cache = ShardedCacheClient({
+            'node1': CacheClient(host='10.0.0.1'),
+            'node2': CacheClient(host='10.0.0.2'),
+        })
+        CacheMixin = cache_mixin(cache, DBSession)
+
+    Multi-key calls are split per shard and the shards are queried in
+    parallel, results are returned in the order of the given keys.
+
+    :param nodes: dict of ``{name: client}``, node names are hashed so they
+                  should be stable across processes.
+    :param replicas: virtual nodes per client on the hash ring.
+    :param pool_size: size of the thread pool querying shards, shared by
+                      all threads using the client, so a multi-key call
+                      may wait for calls of other threads. Size it for
+                      the expected concurrent calls times the shards
+                      each one touches.
+
+    The pool is created on first use and again after a fork, worker
+    threads don't survive ``os.fork()``, e.g. when a pre-forking server
+    loads the app in its master process.
+    """
+
+    def __init__(self, nodes, replicas=160, pool_size=8):
+        self.nodes = dict(nodes)
+        self.ring = HashRing(self.nodes, replicas=replicas)
+        self.pool_size = pool_size
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    def add_node(self, name, client):
+        self.nodes[name] = client
+        self.ring.add_node(name)
+
+    def remove_node(self, name):
+        self.ring.remove_node(name)
+        return self.nodes.pop(name)
+
+    def get_client(self, key):
+        return self.nodes[self.ring.get_node(key)]
+
+    def _group(self, keys):
+        """Group keys by node, keep key positions for reassembling."""
+        groups = {}
+        for pos, key in enumerate(keys):
+            groups.setdefault(self.ring.get_node(key), []).append((pos, key))
+        return groups
+
+    def _map(self, func, items):
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        return self._get_pool().map(func, items)
+
+    def _get_pool(self):
+        pid = os.getpid()
+        if self._pool_pid != pid:
+            if self._pool is not None:
+                # forked, the lock may have been held by a parent thread
+                self._pool_lock = threading.Lock()
+            with self._pool_lock:
+                if self._pool_pid != pid:
+                    self._pool = ThreadPool(self.pool_size)
+                    self._pool_pid = pid
+        return self._pool
+
+    def get(self, key):
+        return self.get_client(key).get(key)
+
+    def mget(self, keys):
+        keys = list(keys)
+        groups = list(self._group(keys).items())
+
+        def _mget(group):
+            node, pairs = group
+            return pairs, self.nodes[node].mget([k for _, k in pairs])
+
+        results = [None] * len(keys)
+        for pairs, vals in self._map(_mget, groups):
+            for (pos, _), val in zip(pairs, vals or ()):
+                results[pos] = val
+        return results
+
+    def set(self, key, val, expiration_time=None):
+        return self.get_client(key).set(key, val, expiration_time)
+
+    def mset(self, mapping, expiration_time=None):
+        groups = list(self._group(list(mapping)).items())
+
+        def _mset(group):
+            node, pairs = group
+            return self.nodes[node].mset(
+                {k: mapping[k] for _, k in pairs},
+                expiration_time=expiration_time)
+
+        return all(self._map(_mset, groups))
+
+    def delete(self, *keys):
+        groups = list(self._group(keys).items())
+
+        def _delete(group):
+            node, pairs = group
+            return self.nodes[node].delete(*[k for _, k in pairs])
+
+        return sum(r or 0 for r in self._map(_delete, groups))
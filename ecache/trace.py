@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""
+  Record cache accesses of :class:`ecache.core.CacheMixinBase` models and
+  replay them through a simulated cache, to try cache sizes, eviction
+  policies and TTLs offline against real traffic::
+
+      from ecache import trace
+
+      trace.install('/tmp/ecache.trace', sample_rate=0.1)
+
+  then::
+
+      ecache-trace-replay /tmp/ecache.trace --capacity 100000 \\
+          --capacity 500000 --policy lru --ttl 3600
+
+  Sampling is done by key, so a sampled key has all of its accesses
+  recorded and replaying keeps its reuse pattern. Capacities given to the
+  replay are scaled by the sample rate stored in the trace.
+"""
+
+import argparse
+import collections
+import hashlib
+import heapq
+import json
+import numbers
+import struct
+import threading
+import time
+
+MAGIC = b'ECTRACE1'
+_HEADER = struct.Struct('<d')
+_RECORD = struct.Struct('<BBHdQ')
+_TABLE_NAME = struct.Struct('<H')
+
+OP_TABLE, OP_GET, OP_SET, OP_FLUSH = 0, 1, 2, 3
+OPS = {'get': OP_GET, 'set': OP_SET, 'flush': OP_FLUSH}
+HIT, MISS, NA = 1, 0, 2
+
+_MAX_KEY = 2 ** 64
+
+
+def key_id(pk):
+    """64 bits id of a primary key."""
+    if isinstance(pk, numbers.Integral) and 0 <= pk < _MAX_KEY:
+        return pk
+    digest = hashlib.md5(repr(pk).encode('utf-8')).digest()
+    return struct.unpack('<Q', digest[:8])[0]
+
+
+class TraceRecorder(object):
+    """Append (timestamp, table, pk, op, hit/miss) records to a file.
+
+    :param sample_rate: fraction of keys recorded.
+    """
+
+    def __init__(self, path, sample_rate=1.0, buffering=64 * 1024):
+        self.sample_rate = sample_rate
+        self._threshold = int(sample_rate * 2 ** 32)
+        self._tables = {}
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb', buffering)
+        self._file.write(MAGIC + _HEADER.pack(sample_rate))
+
+    def _sampled(self, kid):
+        return (kid * 0x9E3779B97F4A7C15 >> 16) % 2 ** 32 < self._threshold
+
+    def _table_id(self, table):
+        table_id = self._tables.get(table)
+        if table_id is None:
+            table_id = self._tables[table] = len(self._tables)
+            name = table.encode('utf-8')
+            self._file.write(_RECORD.pack(OP_TABLE, NA, table_id, 0, 0) +
+                             _TABLE_NAME.pack(len(name)) + name)
+        return table_id
+
+    def record(self, table, op, pks, hit=None):
+        """Record op on pks of table.
+
+        :param op: one of ``get``, ``set`` and ``flush``
+        :param hit: hit/miss for ``get``, a bool or a list of bools per pk
+        """
+        records = []
+        for i, pk in enumerate(pks):
+            kid = key_id(pk)
+            if not self._sampled(kid):
+                continue
+            flag = hit[i] if isinstance(hit, (list, tuple)) else hit
+            records.append((kid, NA if flag is None else int(bool(flag))))
+        if not records:
+            return
+        now = time.time()
+        with self._lock:
+            if self._file.closed:
+                return
+            table_id = self._table_id(table)
+            self._file.write(b''.join(
+                _RECORD.pack(OPS[op], flag, table_id, now, kid)
+                for kid, flag in records))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def install(path, sample_rate=1.0):
+    """Start recording accesses of all cache mixin models."""
+    from ecache.core import CacheMixinBase
+    uninstall()
+    CacheMixinBase._tracer = TraceRecorder(path, sample_rate)
+    return CacheMixinBase._tracer
+
+
+def uninstall():
+    from ecache.core import CacheMixinBase
+    tracer, CacheMixinBase._tracer = CacheMixinBase._tracer, None
+    if tracer is not None:
+        tracer.close()
+
+
+Record = collections.namedtuple('Record', 'ts table op key hit')
+
+
+def read_trace(path):
+    """Read a trace file, return ``(sample_rate, records iterator)``."""
+    f = open(path, 'rb')
+    if f.read(len(MAGIC)) != MAGIC:
+        f.close()
+        raise ValueError("%s is not an ecache trace" % path)
+    sample_rate, = _HEADER.unpack(f.read(_HEADER.size))
+
+    def records():
+        tables = {}
+        with f:
+            while True:
+                data = f.read(_RECORD.size)
+                if len(data) < _RECORD.size:
+                    return
+                op, hit, table_id, ts, kid = _RECORD.unpack(data)
+                if op == OP_TABLE:
+                    size, = _TABLE_NAME.unpack(f.read(_TABLE_NAME.size))
+                    tables[table_id] = f.read(size).decode('utf-8')
+                    continue
+                yield Record(ts, tables[table_id], op, kid, hit)
+    return sample_rate, records()
+
+
+class SimulatedCache(object):
+    """Cache of ``capacity`` keys with ``lru``, ``fifo`` or ``lfu``
+    eviction and an optional TTL.
+    """
+
+    POLICIES = ('lru', 'fifo', 'lfu')
+
+    def __init__(self, capacity, policy='lru', ttl=None):
+        assert policy in self.POLICIES, \
+            'policy should be one of %s' % ', '.join(self.POLICIES)
+        self.capacity = max(int(capacity), 1)
+        self.policy = policy
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.freqs = {}
+        self._heap = []
+        self.evictions = 0
+
+    def get(self, key, now):
+        expire_at = self.entries.get(key)
+        if expire_at is None:
+            return False
+        if expire_at and expire_at <= now:
+            self.delete(key)
+            return False
+        if self.policy == 'lru':
+            del self.entries[key]
+            self.entries[key] = expire_at
+        elif self.policy == 'lfu':
+            self.freqs[key] += 1
+            heapq.heappush(self._heap, (self.freqs[key], key))
+        return True
+
+    def set(self, key, now):
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.capacity:
+            self._evict()
+        self.entries[key] = now + self.ttl if self.ttl else 0
+        if self.policy == 'lfu':
+            self.freqs[key] = self.freqs.get(key, 0) + 1
+            heapq.heappush(self._heap, (self.freqs[key], key))
+
+    def delete(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.freqs.pop(key, None)
+
+    def _evict(self):
+        self.evictions += 1
+        if self.policy != 'lfu':
+            self.entries.popitem(last=False)
+            return
+        while True:
+            freq, key = heapq.heappop(self._heap)
+            if key in self.entries and self.freqs.get(key) == freq:
+                self.delete(key)
+                return
+
+
+def simulate(records, capacity, policy='lru', ttl=None, sample_rate=1.0):
+    """Replay records through a :class:`SimulatedCache`.
+
+    A ``get`` miss counts as a database load and fills the cache, like
+    ``CacheMixinBase.get`` does; ``set`` writes and ``flush`` deletes.
+
+    :param capacity: cache size in keys for the full, unsampled traffic.
+    :return: report dict with hit ratio and database load.
+    """
+    cache = SimulatedCache(capacity * sample_rate, policy, ttl)
+    gets = hits = recorded_hits = 0
+    first = last = None
+    # keys filled by a simulated miss, their recorded fill is skipped
+    filled = set()
+    for r in records:
+        first = r.ts if first is None else first
+        last = r.ts
+        key = (r.table, r.key)
+        if r.op == OP_GET:
+            gets += 1
+            recorded_hits += r.hit == HIT
+            if cache.get(key, r.ts):
+                hits += 1
+            else:
+                cache.set(key, r.ts)
+                filled.add(key)
+        elif r.op == OP_SET:
+            if key in filled:
+                filled.discard(key)
+            else:
+                cache.set(key, r.ts)
+        elif r.op == OP_FLUSH:
+            filled.discard(key)
+            cache.delete(key)
+
+    duration = (last - first) if first is not None else 0
+    misses = gets - hits
+    return {
+        'capacity': capacity,
+        'policy': policy,
+        'ttl': ttl,
+        'gets': gets,
+        'hit_ratio': float(hits) / gets if gets else None,
+        'recorded_hit_ratio': float(recorded_hits) / gets if gets else None,
+        'db_loads': int(misses / sample_rate),
+        'db_loads_per_sec': misses / sample_rate / duration
+        if duration else None,
+        'evictions': cache.evictions,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay an ecache access trace through simulated caches.")
+    parser.add_argument('trace')
+    parser.add_argument('--capacity', type=int, action='append',
+                        required=True, help="cache size in keys, repeatable")
+    parser.add_argument('--policy', choices=SimulatedCache.POLICIES,
+                        action='append', help="eviction policy, repeatable")
+    parser.add_argument('--ttl', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    reports = []
+    for policy in args.policy or ['lru']:
+        for capacity in args.capacity:
+            sample_rate, records = read_trace(args.trace)
+            reports.append(simulate(records, capacity, policy, args.ttl,
+                                    sample_rate))
+    print(json.dumps(reports, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
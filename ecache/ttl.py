@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import math
+import threading
+import time
+
+
+class AdaptiveTTL(object):
+    """TTL policy driven by read and write frequency of each key.
+
+    Keys read often and written rarely get TTLs close to ``max_ttl``, cold
+    or frequently written keys get TTLs close to ``min_ttl``::
+
+        class TodoListModel(DeclarativeBase, CacheMixin):
+            TTL_POLICY = AdaptiveTTL(min_ttl=60, max_ttl=86400)
+
+    TTLs are rounded to powers of two times ``min_ttl``, so a batch of
+    keys falls into few distinct TTLs.
+
+    :param half_heat: reads per write within a window at which the TTL is
+                      halfway between ``min_ttl`` and ``max_ttl``.
+    :param window: counters are halved every ``window`` seconds.
+    :param capacity: max keys tracked, counters are halved early if more.
+    """
+
+    def __init__(self, min_ttl, max_ttl, half_heat=10, window=300,
+                 capacity=100000):
+        assert 0 < min_ttl <= max_ttl, 'should be 0 < min_ttl <= max_ttl!'
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.half_heat = float(half_heat)
+        self.window = window
+        self.capacity = capacity
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._decay_at = time.time() + window
+
+    def _decay(self):
+        self.counters = {
+            k: [r // 2, w // 2] for k, (r, w) in self.counters.items()
+            if r > 1 or w > 1}
+        self._decay_at = time.time() + self.window
+
+    def _record(self, keys, idx):
+        with self._lock:
+            if time.time() >= self._decay_at or \
+                    len(self.counters) > self.capacity:
+                self._decay()
+            for key in keys:
+                counter = self.counters.get(key)
+                if counter is None:
+                    counter = self.counters[key] = [0, 0]
+                counter[idx] += 1
+
+    def record_reads(self, keys):
+        self._record(keys, 0)
+
+    def record_writes(self, keys):
+        self._record(keys, 1)
+
+    def ttl(self, key):
+        reads, writes = self.counters.get(key, (0, 0))
+        heat = reads / (1.0 + writes)
+        ttl = self.min_ttl + \
+            (self.max_ttl - self.min_ttl) * heat / (heat + self.half_heat)
+        # round to a power of two times min_ttl, within bounds
+        ttl = self.min_ttl * 2 ** int(round(math.log(ttl / self.min_ttl, 2)))
+        return int(min(max(ttl, self.min_ttl), self.max_ttl))
@@ -27,6 +27,13 @@ setup(
     url="https://github.com/MrKiven/ECache",
     packages=find_packages() + ['include/meepo'],
     license='MIT',
+    entry_points={
+        'console_scripts': [
+            'ecache-preload = ecache.preload:main',
+            'ecache-reconcile = ecache.reconcile:main',
+            'ecache-trace-replay = ecache.trace:main',
+        ],
+    },
     install_requires=[
         'SQLAlchemy==0.9.3',
         'redis>=2.10.5',
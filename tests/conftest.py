@@ -1,6 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import pytest
+import sqlalchemy as sa
+
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from ecache.core import CacheMixinBase
 from ecache.db import make_session, create_engine
+from ecache.memory import MemoryCacheClient
 
 
 MYSQL_SETTINGS = {
@@ -16,3 +24,43 @@ engines = {
 engine = engines['master']
 
 DBSession = make_session(engines, info={"name": "test"})
+
+
+# models cached in memory and stored in SQLite, for tests of tools and
+# hooks needing a real database
+memory_engine = sa.create_engine('sqlite://')
+MemorySession = scoped_session(sessionmaker(memory_engine))
+MemoryBase = declarative_base()
+
+
+class MemoryCacheMixin(CacheMixinBase):
+    _cache_client = MemoryCacheClient()
+    _db_session = MemorySession
+
+
+class Item(MemoryBase, MemoryCacheMixin):
+    __tablename__ = 'item'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String)
+    group = sa.Column(sa.Integer)
+    updated = sa.Column(sa.Integer)
+
+
+@pytest.fixture
+def items():
+    """10 items in database, an empty cache."""
+    MemoryBase.metadata.create_all(memory_engine)
+    memory_engine.execute(Item.__table__.insert(), [
+        {'id': i, 'name': 'item%d' % i, 'group': i % 2, 'updated': i}
+        for i in range(1, 11)])
+    MemoryCacheMixin._cache_client = MemoryCacheClient()
+    yield
+    MemorySession.remove()
+    MemoryBase.metadata.drop_all(memory_engine)
+
+
+def cached_items(pks):
+    """Cached raw data of items, None if not cached."""
+    return MemoryCacheMixin._cache_client.mget(
+        [Item.gen_raw_key(pk) for pk in pks])
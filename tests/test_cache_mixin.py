@@ -94,6 +94,20 @@ def test_mset(monkeypatch):
     )
 
 
+def test_mset_per_ttl():
+    u1 = User(id=0, name='hello')
+    u2 = User(id=1, name='world')
+    policy = mock.Mock(ttl=lambda pk: 60 * (pk + 1))
+
+    with mock.patch.object(User, 'TTL_POLICY', policy), \
+            mock.patch.object(StrictRedis, 'mset',
+                              side_effect=[True, False]) as mock_mset:
+        assert User.mset([u1, u2]) is False
+
+    assert sorted(c[1]['expiration_time']
+                  for c in mock_mset.call_args_list) == [60, 120]
+
+
 def test_get_from_session(monkeypatch, DBSession):
     session = DBSession()
 
@@ -127,3 +141,21 @@ def test_get_from_db(monkeypatch):
     assert r is u
 
     mock_set.assert_called_with("user|0", {'id': 0, 'name': 'hello'}, None)
+
+
+def test_get_hot_key_from_local(monkeypatch, DBSession):
+    monkeypatch.setattr(CacheMixin, "_db_session", DBSession)
+    monkeypatch.setattr(User, "HOT_KEY_THRESHOLD", 1)
+    monkeypatch.setattr(User, "HOT_KEY_SAMPLE_RATE", 1)
+    monkeypatch.setattr(CacheMixin, "_hot_key_trackers", {})
+
+    u = User(id=0, name="hello")
+    with mock.patch.object(StrictRedis, "get",
+                           return_value=u.__rawdata__) as mock_get:
+        User.get(0)
+        DBSession.remove()
+        m = User.get(0)
+        assert m._cached
+
+    assert mock_get.call_count == 1
+    assert User.hot_keys() == [(0, 1)]
@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import pytest
+import redis
+from dogpile.cache.region import make_region
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from dogpile.cache.api import NO_VALUE
+
+from ecache.ext.flask_cache import CacheableMixin, CachingQuery, FromCache, \
+    _key_from_query, bump_table_version, memoize, query_callable
+
+
+regions = dict(
+    default=make_region().configure('dogpile.cache.memory_pickle'),
+    redis=make_region().configure('dogpile.cache.redis',
+                                  arguments={'db': 15}),
+)
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db = SQLAlchemy(app)
+
+
+def _sqlite_connect(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+def _sqlite_begin(conn):
+    conn.execute('BEGIN')
+
+
+# pysqlite needs to leave transactions to SQLAlchemy for savepoints to work
+with app.app_context():
+    event.listen(db.engine, 'connect', _sqlite_connect)
+    event.listen(db.engine, 'begin', _sqlite_begin)
+
+
+class User(db.Model, CacheableMixin):
+    cache_regions = regions
+    query_class = query_callable(regions)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(32))
+    group = db.Column(db.Integer)
+
+
+class Todo(db.Model, CacheableMixin):
+    cache_label = 'redis'
+    cache_regions = regions
+    cache_list_indexes = (('user_id',), ('user_id', 'done'))
+    cache_order_by = 'created'
+    query_class = query_callable(regions)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer)
+    done = db.Column(db.Boolean, default=False)
+    created = db.Column(db.Integer)
+
+
+class Tag(db.Model):
+    query_class = query_callable(regions)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(32))
+
+
+@pytest.fixture
+def users():
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(User(id=i, name='user%d' % i, group=i % 2)
+                           for i in range(1, 11))
+        db.session.commit()
+        db.session.remove()
+        regions['default'].backend._cache.clear()
+        yield
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def todos():
+    client = regions['redis'].backend.client
+    try:
+        client.flushdb()
+    except redis.ConnectionError:
+        pytest.skip('redis is not available')
+    with app.app_context():
+        db.create_all()
+        # created in reverse order of ids
+        db.session.add_all(Todo(id=i, user_id=i % 2, done=i > 6,
+                                created=100 - i) for i in range(1, 11))
+        db.session.commit()
+        db.session.remove()
+        yield client
+        db.session.remove()
+        db.drop_all()
+    client.flushdb()
+
+
+@pytest.fixture
+def statements(users):
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        executed.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_get_multi_fills_misses_with_one_query(statements):
+    User.cache.get(1)
+    db.session.expunge_all()
+    del statements[:]
+
+    objs = User.cache.get_multi([3, 1, 42, 2])
+
+    assert [o and o.id for o in objs] == [3, 1, None, 2]
+    assert len(statements) == 1
+    assert ' IN ' in statements[0]
+
+    db.session.expunge_all()
+    del statements[:]
+    assert [o.id for o in User.cache.get_multi([2, 3])] == [2, 3]
+    assert statements == []
+
+
+def test_get_multi_missing_row_cached_by_get(statements):
+    assert User.cache.get(50) is None
+
+    objs = User.cache.get_multi([1, 50])
+
+    assert objs[0].id == 1 and objs[1] is None
+
+
+def test_filter_stores_pk_list(statements):
+    assert [u.id for u in User.cache.filter(group=1)] == [1, 3, 5, 7, 9]
+    key = User.cache._cache_key(group=1)
+    assert regions['default'].get(key) == [1, 3, 5, 7, 9]
+
+    db.session.expunge_all()
+    del statements[:]
+    assert [u.id for u in User.cache.filter(group=1)] == [1, 3, 5, 7, 9]
+    assert statements == []
+
+
+def test_filter_offset_limit(users):
+    assert [u.id for u in User.cache.filter(group=0, offset=1)] == \
+        [4, 6, 8, 10]
+    assert [u.id for u in User.cache.filter(
+        group=0, order_by='desc', offset=1, limit=2)] == [8, 6]
+
+
+def _ids(objs):
+    return [o.id for o in objs]
+
+
+def test_index_order_and_pagination(todos):
+    assert _ids(Todo.cache.filter(user_id=0)) == [10, 8, 6, 4, 2]
+    assert todos.exists(Todo.cache._index_key(user_id=0))
+
+    assert _ids(Todo.cache.filter(user_id=0)) == [10, 8, 6, 4, 2]
+    assert _ids(Todo.cache.filter(user_id=0, offset=1, limit=2)) == [8, 6]
+    assert _ids(Todo.cache.filter(user_id=0, order_by='desc')) == \
+        [2, 4, 6, 8, 10]
+    assert _ids(Todo.cache.filter(user_id=0, order_by='desc', offset=3,
+                                  limit=5)) == [8, 10]
+    assert _ids(Todo.cache.filter(user_id=1, done=True)) == [9, 7]
+
+
+def test_index_empty_result(todos):
+    assert _ids(Todo.cache.filter(user_id=5)) == []
+    key = Todo.cache._index_key(user_id=5)
+    assert todos.zcard(key) == 1
+    assert _ids(Todo.cache.filter(user_id=5)) == []
+
+
+def test_index_follows_writes(todos):
+    for kwargs in ({'user_id': 0}, {'user_id': 1}, {'user_id': 1,
+                                                    'done': True}):
+        list(Todo.cache.filter(**kwargs))
+
+    db.session.add(Todo(id=11, user_id=1, done=True, created=94))
+    todo = Todo.query.get(2)
+    todo.user_id = 1
+    db.session.delete(Todo.query.get(9))
+    db.session.commit()
+    db.session.expunge_all()
+
+    assert _ids(Todo.cache.filter(user_id=0)) == [10, 8, 6, 4]
+    assert _ids(Todo.cache.filter(user_id=1)) == [7, 11, 5, 3, 2, 1]
+    assert _ids(Todo.cache.filter(user_id=1, done=True)) == [7, 11]
+
+
+def test_index_needs_numeric_order_by():
+    with pytest.raises(TypeError):
+        class Note(db.Model, CacheableMixin):
+            cache_regions = regions
+            cache_list_indexes = (('user_id',),)
+            cache_order_by = 'title'
+
+            id = db.Column(db.Integer, primary_key=True)
+            user_id = db.Column(db.Integer)
+            title = db.Column(db.String(32))
+
+
+def _shaped_key(*criterion, **kwargs):
+    query = User.query.options(FromCache(shape='user_by_name')).filter(
+        *criterion)
+    if 'limit' in kwargs:
+        query = query.limit(kwargs['limit'])
+    if 'offset' in kwargs:
+        query = query.offset(kwargs['offset'])
+    return _key_from_query(query)
+
+
+def test_shaped_keys(users):
+    key = _shaped_key(User.name == 'user1', limit=10)
+    assert key.startswith('user_by_name:')
+    assert _shaped_key(User.name == 'user1', limit=10) == key
+    assert _shaped_key(User.name == 'user2', limit=10) != key
+    assert _shaped_key(User.name == 'user1', limit=20) != key
+    assert _shaped_key(User.name == 'user1', limit=10, offset=10) != key
+    assert _shaped_key(User.name == 'user1', limit=10, offset=10) != \
+        _shaped_key(User.name == 'user1', limit=10, offset=20)
+    assert _shaped_key(User.name == 'a b', User.group == 'c') != \
+        _shaped_key(User.name == 'a', User.group == 'b c')
+
+
+def test_shaped_keys_non_ascii(users):
+    assert _shaped_key(User.name == '\xe4\xb8\xad') != \
+        _shaped_key(User.name == u'文')
+    assert _shaped_key(User.name == u'文') == \
+        _shaped_key(User.name == u'文')
+
+
+def test_session_query_cls(users):
+    session = sessionmaker(db.engine, query_cls=query_callable(regions))()
+    query = session.query(User).options(FromCache())
+
+    assert isinstance(query, CachingQuery)
+    assert len(query.filter(User.group == 1).all()) == 5
+    session.close()
+
+
+def _cached_value(query):
+    region, key = query._get_cache_plus_key()
+    value = region.get(key)
+    return value[1] if isinstance(value, tuple) else value
+
+
+def test_normalized_warm_read(statements):
+    query = User.query.options(FromCache(normalized=True)).filter(
+        User.group == 1)
+    assert _ids(query) == [1, 3, 5, 7, 9]
+    assert _cached_value(query) == [1, 3, 5, 7, 9]
+
+    db.session.expunge_all()
+    del statements[:]
+    assert _ids(query) == [1, 3, 5, 7, 9]
+    assert statements == []
+
+
+@pytest.mark.parametrize('tag_tables', [True, False])
+def test_normalized_row_update(users, tag_tables):
+    query = User.query.options(
+        FromCache(normalized=True, tag_tables=tag_tables)).filter(
+            User.group == 1)
+    assert [u.name for u in query][:2] == ['user1', 'user3']
+
+    User.query.get(3).name = 'changed'
+    db.session.commit()
+    db.session.expunge_all()
+
+    assert [u.name for u in query][:2] == ['user1', 'changed']
+
+
+def test_normalized_fallbacks(users):
+    db.session.add(Tag(id=1, name='tag1'))
+    db.session.commit()
+
+    query = Tag.query.options(FromCache(normalized=True))
+    assert [t.name for t in query] == ['tag1']
+    assert [t.name for t in _cached_value(query)] == ['tag1']
+
+    query = User.query.options(FromCache(normalized=True)).add_columns(
+        User.name).filter(User.id == 1)
+    assert [(u.id, name) for u, name in query] == [(1, 'user1')]
+    cached = _cached_value(query)
+    assert len(cached) == 1 and cached[0][1] == 'user1'
+
+
+@pytest.mark.parametrize('tag_tables', [True, False])
+def test_table_tags_invalidate_on_write(users, tag_tables):
+    query = User.query.options(FromCache(tag_tables=tag_tables)).filter(
+        User.group == 0)
+    assert [u.name for u in query][:1] == ['user2']
+
+    User.query.get(2).name = 'changed'
+    db.session.commit()
+    db.session.expunge_all()
+
+    assert [u.name for u in query][:1] == \
+        ['changed' if tag_tables else 'user2']
+
+
+def test_table_tags_of_joined_tables(users):
+    db.session.add(Tag(id=1, name='user1'))
+    db.session.commit()
+    query = User.query.options(FromCache()).join(
+        Tag, Tag.name == User.name)
+    assert _ids(query) == [1]
+
+    db.session.add(Tag(id=2, name='user2'))
+    db.session.commit()
+    assert _ids(query) == [1]
+
+    bump_table_version(regions['default'], 'tag')
+    assert _ids(query) == [1, 2]
+
+
+def test_table_tags_memoized(users):
+    query = User.query.options(FromCache()).filter(User.group == 0)
+    list(query)
+    with mock.patch('ecache.ext.flask_cache.find_tables') as find_tables:
+        list(User.query.options(FromCache()).filter(User.group == 1))
+        list(User.query.options(FromCache(shape='group')).filter(
+            User.group == 1))
+        list(User.query.options(FromCache(shape='group')).filter(
+            User.group == 0))
+    assert find_tables.call_count == 1
+
+
+def test_memoize_lru():
+    calls = []
+
+    @memoize(maxsize=2)
+    def double(x):
+        calls.append(x)
+        return x * 2
+
+    assert [double(1), double(2), double(1)] == [2, 4, 2]
+    assert double(3) == 6
+    assert double(1) == 2
+    assert double(2) == 4
+    assert calls == [1, 2, 3, 2]
+    assert double.cache_info() == {'hits': 2, 'misses': 4, 'size': 2,
+                                   'maxsize': 2}
+
+
+def test_memoize_kwargs_and_unhashable():
+    calls = []
+
+    @memoize
+    def join(items, sep=','):
+        calls.append(items)
+        return sep.join(items)
+
+    assert join(('a', 'b'), sep='-') == join(('a', 'b'), sep='-') == 'a-b'
+    assert join(('a', 'b')) == 'a,b'
+    assert join(['a', 'b']) == join(['a', 'b']) == 'a,b'
+    assert len(calls) == 4
+    assert join.cache_info() == {'hits': 1, 'misses': 2, 'size': 2,
+                                 'maxsize': 1024}
+
+
+def _cached_row(pk):
+    return regions['default'].get(User.cache._cache_key(pk))
+
+
+def test_pending_flush_sent_on_commit(users):
+    User.cache.get(1)
+    User.query.get(1).name = 'changed'
+    db.session.flush()
+    assert _cached_row(1) is not NO_VALUE
+
+    db.session.commit()
+    assert _cached_row(1) is NO_VALUE
+    assert User.cache.get(1).name == 'changed'
+
+
+def test_declare_last_listens_once(users):
+    # run again, like configure_mappers does for classes mapped later
+    User.__declare_last__()
+    Todo.__declare_last__()
+    with mock.patch.object(User.cache, '_flush_all') as flush_all:
+        User.query.get(1).name = 'changed'
+        db.session.flush()
+    assert flush_all.call_count == 1
+    assert event.contains(Todo, 'after_insert', Todo._index_insert_event)
+
+
+def test_pending_flush_dropped_on_rollback(users):
+    User.cache.get(1)
+    User.query.get(1).name = 'changed'
+    db.session.flush()
+    db.session.rollback()
+    assert _cached_row(1) is not NO_VALUE
+
+    db.session.commit()
+    assert _cached_row(1) is not NO_VALUE
+    assert User.cache.get(1).name == 'user1'
+
+
+def test_pending_flush_savepoint_rollback(users):
+    User.cache.get(1)
+    User.cache.get(2)
+    User.query.get(1).name = 'changed'
+    db.session.flush()
+
+    db.session.begin_nested()
+    User.query.get(2).name = 'changed'
+    db.session.flush()
+    db.session.rollback()
+    assert _cached_row(1) is not NO_VALUE
+
+    db.session.commit()
+    db.session.expunge_all()
+    assert User.cache.get(1).name == 'changed'
+    assert _cached_row(2) is not NO_VALUE
+    assert User.cache.get(2).name == 'user2'
+
+
+def test_pending_flush_savepoint_commit(users):
+    User.cache.get(1)
+    db.session.begin_nested()
+    User.query.get(1).name = 'changed'
+    db.session.commit()
+    assert _cached_row(1) is not NO_VALUE
+
+    db.session.commit()
+    db.session.expunge_all()
+    assert User.cache.get(1).name == 'changed'
+
+
+def test_pending_flush_errors_logged(users):
+    User.cache.get(1)
+    User.query.get(1).name = 'changed'
+    region = regions['default']
+    with mock.patch.object(region, 'delete_multi',
+                           side_effect=redis.ConnectionError), \
+            mock.patch('ecache.ext.flask_cache.logger') as logger:
+        db.session.commit()
+
+    assert logger.exception.called
+    assert User.query.get(1).name == 'changed'
+    # the table version bump still went through
+    query = User.query.options(FromCache()).filter(User.id == 1)
+    assert [u.name for u in query] == ['changed']
+
+
+def _chunk_keys():
+    return sorted(k for k in regions['default'].backend._cache
+                  if ':chunk:' in k)
+
+
+def test_chunked_hit(statements):
+    query = User.query.options(FromCache(chunk_size=3)).order_by(User.id)
+    assert _ids(query) == list(range(1, 11))
+    assert len(_chunk_keys()) == 4
+
+    db.session.expunge_all()
+    del statements[:]
+    assert _ids(query) == list(range(1, 11))
+    assert statements == []
+
+
+def test_chunked_evicted_mid_read(statements):
+    query = User.query.options(FromCache(chunk_size=3)).order_by(User.id)
+    list(query)
+    regions['default'].delete(_chunk_keys()[1])
+
+    db.session.expunge_all()
+    assert _ids(query) == list(range(1, 11))
+    # refilled under new chunk keys, the old ones are deleted
+    assert len(_chunk_keys()) == 4
+    db.session.expunge_all()
+    del statements[:]
+    assert _ids(query) == list(range(1, 11))
+    assert statements == []
+
+
+def test_chunked_empty_result(statements):
+    query = User.query.options(FromCache(chunk_size=3)).filter(
+        User.group == 5)
+    assert list(query) == []
+    del statements[:]
+    assert list(query) == []
+    assert statements == []
+    assert _chunk_keys() == []
+
+
+def test_chunked_stale_fill_not_visible(users):
+    query = User.query.options(FromCache(chunk_size=3)).order_by(User.id)
+    list(query)
+    stale_keys = _chunk_keys()
+
+    User.query.get(1).name = 'changed'
+    db.session.commit()
+    db.session.expunge_all()
+    assert [u.name for u in query][0] == 'changed'
+    # the refill replaced the chunks of the first fill
+    assert len(_chunk_keys()) == 4
+    assert not set(stale_keys) & set(_chunk_keys())
+
+    # an older fill finishing late only writes to its own chunk keys
+    stale = User.query.filter(User.id.in_([1, 2, 3])).all()
+    for obj in stale:
+        obj.name = 'stale'
+    regions['default'].set(stale_keys[0], stale)
+    db.session.rollback()
+    db.session.expunge_all()
+    assert [u.name for u in query][0] == 'changed'
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import pytest
+import sqlalchemy as sa
+
+from ecache.hook import EventHook, _pks_from_criterion
+
+from tests.conftest import Item, MemorySession, cached_items
+
+
+hook = EventHook([], MemorySession)
+hook.add(Item)
+pk = Item.__table__.c.id
+
+
+@pytest.fixture(autouse=True)
+def cached(items):
+    for i in range(1, 11):
+        Item.get(i)
+    MemorySession.remove()
+
+
+def _cached(pks):
+    return [raw is not None for raw in cached_items(pks)]
+
+
+@pytest.mark.parametrize('criterion, pks', [
+    (Item.id == 1, {1}),
+    (Item.id.in_([1, 2]), {1, 2}),
+    (sa.and_(Item.id.in_([1, 2, 3]), Item.id == 2), {2}),
+    (sa.and_(Item.id.in_([1, 2]), Item.group == 1), {1, 2}),
+    (sa.or_(Item.id == 1, Item.id.in_([4, 5])), {1, 4, 5}),
+    (sa.or_(Item.id == 1, Item.group == 1), None),
+    (Item.group == 1, None),
+    (Item.id == Item.group, None),
+    (Item.id == sa.func.abs(-1), None),
+    (Item.id.in_(sa.select([Item.group]).where(Item.name == 'a')), None),
+    (Item.id.in_([1, Item.group]), None),
+])
+def test_pks_from_criterion(criterion, pks):
+    assert _pks_from_criterion(criterion, pk) == pks
+
+
+def test_bulk_update_by_pk():
+    session = MemorySession()
+    session.query(Item).filter(Item.id.in_([1, 2])).update(
+        {'name': 'changed'}, synchronize_session=False)
+    assert _cached([1, 2]) == [True, True]
+    session.commit()
+    assert _cached(range(1, 5)) == [False, False, True, True]
+    assert Item.get(1).name == 'changed'
+
+
+def test_bulk_update_fetch():
+    session = MemorySession()
+    session.query(Item).filter(Item.name.in_(['item3', 'item4'])).update(
+        {'group': 5}, synchronize_session='fetch')
+    session.commit()
+    assert _cached(range(1, 6)) == [True, True, False, False, True]
+
+
+def test_bulk_update_rolled_back():
+    session = MemorySession()
+    session.query(Item).filter(Item.id == 1).update(
+        {'name': 'changed'}, synchronize_session=False)
+    session.rollback()
+    session.commit()
+    assert _cached([1]) == [True]
+
+
+def test_bulk_update_selects_matching_rows():
+    session = MemorySession()
+    with mock.patch.object(Item, 'BULK_INVALIDATE_LIMIT', 5):
+        session.query(Item).filter(Item.group == 1).update(
+            {'name': 'changed'}, synchronize_session=False)
+        session.commit()
+    assert _cached(range(1, 11)) == [False, True] * 5
+
+
+def test_bulk_update_bumps_generation():
+    session = MemorySession()
+    with mock.patch.object(Item, 'BULK_INVALIDATE_LIMIT', 3), \
+            mock.patch.object(Item, 'TABLE_GENERATION', True), \
+            mock.patch.object(Item, 'bump_generation') as bump, \
+            mock.patch.object(Item, 'flush') as flush:
+        session.query(Item).filter(Item.group == 1).update(
+            {'name': 'changed'}, synchronize_session=False)
+        # pks of a criterion on changed columns can't be selected after
+        session.query(Item).filter(Item.name == 'item2').update(
+            {'name': 'changed'}, synchronize_session=False)
+        session.commit()
+    bump.assert_called_once_with()
+    assert not flush.called
+
+
+def test_bulk_delete_default_sync():
+    session = MemorySession()
+    session.query(Item).filter(Item.group == 1).delete()
+    session.commit()
+    assert _cached(range(1, 11)) == [False, True] * 5
+    assert Item.get(1) is None
+
+
+def test_bulk_delete_selects_before_delete():
+    session = MemorySession()
+    with mock.patch.object(Item, 'BULK_INVALIDATE_LIMIT', 6):
+        session.query(Item).filter(Item.name.in_(['item2', 'item3'])).delete(
+            synchronize_session=False)
+        session.query(Item).filter(Item.id > 4).delete(
+            synchronize_session=False)
+        session.commit()
+    assert _cached(range(1, 11)) == [True, False, False, True] + [False] * 6
+
+
+def test_bulk_delete_subquery():
+    session = MemorySession()
+    subquery = sa.select([Item.id]).where(Item.group == 0)
+    session.query(Item).filter(Item.id.in_(subquery)).delete(
+        synchronize_session=False)
+    session.commit()
+    assert _cached(range(1, 11)) == [True, False] * 5
+
+
+def test_bulk_delete_over_limit_bumps_generation():
+    session = MemorySession()
+    with mock.patch.object(Item, 'BULK_INVALIDATE_LIMIT', 3), \
+            mock.patch.object(Item, 'TABLE_GENERATION', True), \
+            mock.patch.object(Item, 'bump_generation') as bump:
+        session.query(Item).filter(Item.group == 0).delete()
+        session.commit()
+    bump.assert_called_once_with()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import mock
+
+from ecache.hotkey import HotKeyTracker, SpaceSaving
+
+
+def test_space_saving_top():
+    counter = SpaceSaving(capacity=3)
+    for key in [1, 1, 1, 2, 2, 3, 4, 1]:
+        counter.add(key)
+
+    assert len(counter.counts) == 3
+    assert counter.top(1) == [(1, 4)]
+
+
+def test_tracker_pins_hot_key():
+    tracker = HotKeyTracker(threshold=5, sample_rate=1)
+
+    assert not any(tracker.record(1) for _ in range(4))
+    assert tracker.record(1)
+    assert tracker.top() == [(1, 5)]
+
+    tracker.pin(1, {"id": 1})
+    assert tracker.get(1) == {"id": 1}
+    tracker.update(1, {"id": 1, "name": "hello"})
+    assert tracker.get(1) == {"id": 1, "name": "hello"}
+    tracker.evict(1)
+    assert tracker.get(1) is None
+
+
+def test_tracker_local_copy_expires():
+    tracker = HotKeyTracker(threshold=1, sample_rate=1, ttl=1)
+    with mock.patch('time.time', return_value=1000):
+        tracker.pin(1, {"id": 1})
+    with mock.patch('time.time', return_value=1002):
+        assert tracker.get(1) is None
+
+
+def test_tracker_update_ignores_cold_key():
+    tracker = HotKeyTracker(threshold=1, sample_rate=1)
+    tracker.update(1, {"id": 1})
+    assert tracker.get(1) is None
+
+
+def test_space_saving_error():
+    counter = SpaceSaving(capacity=2)
+    for key in [1, 1, 1, 2, 3]:
+        counter.add(key)
+
+    assert counter.counts == {1: 3, 3: 2}
+    assert counter.guaranteed(1) == 3
+    assert counter.guaranteed(3) == 1
+    assert counter.guaranteed(2) == 0
+
+
+def test_tracker_ignores_uniform_traffic():
+    tracker = HotKeyTracker(threshold=2000)
+    rng = random.Random(0)
+    with mock.patch('random.random', rng.random):
+        hot = set(key for key in (rng.randrange(100000)
+                                  for _ in range(200000))
+                  if tracker.record(key))
+        assert not hot
+
+        # a real hot key is still found among them
+        assert any(tracker.record(key)
+                   for key in (rng.choice([7, rng.randrange(100000)])
+                               for _ in range(200000)))
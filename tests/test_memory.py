@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import mock
+
+from ecache.memory import MemoryCacheClient
+
+
+def test_get_set_delete():
+    cache = MemoryCacheClient()
+    val = {"id": 0, "name": "hello"}
+    cache.set("user|0", val, 60)
+
+    cached = cache.get("user|0")
+    assert cached == val
+    assert cached is not val
+    assert cache.delete("user|0", "user|1") == 1
+    assert cache.get("user|0") is None
+
+
+def test_mget_mset():
+    cache = MemoryCacheClient()
+    cache.mset({"user|0": 0, "user|1": 1}, expiration_time=60)
+
+    assert cache.mget(k for k in ["user|1", "user|2", "user|0"]) == \
+        [1, None, 0]
+
+
+def test_expiration():
+    cache = MemoryCacheClient()
+    with mock.patch('time.time', return_value=1000):
+        cache.set("user|0", 0, 10)
+        cache.set("user|1", 1, None)
+    with mock.patch('time.time', return_value=1011):
+        assert cache.get("user|0") is None
+        assert cache.get("user|1") == 1
+
+
+def test_eviction_by_memory():
+    cache = MemoryCacheClient(max_bytes=4096, stripes=1, stats=True)
+    for i in range(100):
+        cache.set("user|%d" % i, "x" * 100)
+
+    assert cache.size <= 4096
+    assert cache.get("user|99") == "x" * 100
+    assert cache.get("user|0") is None
+    assert cache.stats()['evictions'] > 0
+
+
+def test_stats():
+    assert MemoryCacheClient().stats() == {}
+
+    cache = MemoryCacheClient(stats=True)
+    cache.set("user|0", 0)
+    cache.get("user|0")
+    cache.get("user|1")
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['items']) == (1, 1, 1)
+
+
+def test_threads():
+    cache = MemoryCacheClient(stripes=4)
+
+    def worker(n):
+        for i in range(200):
+            cache.set("%d|%d" % (n, i), i)
+            assert cache.get("%d|%d" % (n, i)) == i
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(cache) == 1600
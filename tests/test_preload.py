@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import mock
+import pytest
+
+from ecache.preload import preload
+
+from tests.conftest import Item, MemorySession, cached_items
+
+
+pytestmark = pytest.mark.usefixtures('items')
+
+
+def _names(pks):
+    return [raw and raw['name'] for raw in cached_items(pks)]
+
+
+def test_preload():
+    assert preload(Item, chunk_size=3, criterion=Item.id > 2) == 8
+    assert _names([1, 2]) == [None, None]
+    assert _names(range(3, 11)) == ['item%d' % i for i in range(3, 11)]
+
+
+def test_preload_keeps_cached_rows():
+    # written by a hook after preload read the row
+    Item._cache_client.set(Item.gen_raw_key(2), {'id': 2, 'name': 'newer'})
+
+    assert preload(Item, chunk_size=3) == 9
+    assert _names([1, 2, 3]) == ['item1', 'newer', 'item3']
+
+
+def test_preload_reads_from_master():
+    session = MemorySession()
+    using_bind = session.using_bind = mock.Mock()
+    session._name = None
+    try:
+        preload(Item)
+    finally:
+        del session.using_bind, session._name
+    assert using_bind.call_args_list == [mock.call('master'), mock.call(None)]
+
+
+def test_preload_ends_transaction_per_chunk():
+    session = MemorySession()
+    with mock.patch.object(session, 'close', wraps=session.close) as close:
+        preload(Item, chunk_size=3)
+    # after each of the 4 chunks and once at the end
+    assert close.call_count == 5
+    assert not session.identity_map
+    assert not session.transaction._connections
+
+
+def test_checkpoint(tmpdir):
+    checkpoint = str(tmpdir.join('item.ckpt'))
+    calls = []
+
+    def mset(objs):
+        calls.append(objs)
+        if len(calls) == 2:
+            raise RuntimeError("cache down")
+
+    with mock.patch.object(Item, 'mset', side_effect=mset):
+        with pytest.raises(RuntimeError):
+            preload(Item, chunk_size=3, checkpoint=checkpoint)
+    assert json.load(open(checkpoint)) == {'table': 'item', 'last_pk': 3}
+
+    assert preload(Item, chunk_size=3, checkpoint=checkpoint) == 7
+    assert _names([3, 4]) == [None, 'item4']
+    # a completed run doesn't leave its checkpoint behind
+    assert not tmpdir.join('item.ckpt').exists()
+    assert preload(Item, chunk_size=3, checkpoint=checkpoint) == 3
+
+
+def test_checkpoint_of_other_table(tmpdir):
+    checkpoint = tmpdir.join('other.ckpt')
+    checkpoint.write(json.dumps({'table': 'other', 'last_pk': 5}))
+
+    with pytest.raises(ValueError):
+        preload(Item, checkpoint=str(checkpoint))
+    assert _names([1]) == [None]
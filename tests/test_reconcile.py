@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import pytest
+
+from ecache.reconcile import reconcile
+
+from tests.conftest import Item, MemorySession, cached_items, memory_engine
+
+
+@pytest.fixture(autouse=True)
+def cached(items):
+    # rows 1 to 4 cached, 2 and 4 drifted
+    for i in range(1, 5):
+        Item._cache_client.set(Item.gen_raw_key(i), {
+            'id': i, 'name': 'item%d' % i, 'group': i % 2, 'updated': i})
+    for i in (2, 4):
+        Item._cache_client.set(Item.gen_raw_key(i), {
+            'id': i, 'name': 'stale', 'group': i % 2, 'updated': i})
+
+
+def _names(pks):
+    return [raw and raw['name'] for raw in cached_items(pks)]
+
+
+def test_report_by_default():
+    stats = reconcile(Item, batch_size=4, updated_column='updated', since=2)
+    assert stats == dict(scanned=9, cached=3, matched=1, drifted=2, fixed=0,
+                         last_updated=10)
+    assert _names([2, 4]) == ['stale', 'stale']
+
+
+def test_evict():
+    stats = reconcile(Item, mode='evict', batch_size=4)
+    assert (stats['drifted'], stats['fixed']) == (2, 2)
+    assert _names(range(1, 6)) == ['item1', None, 'item3', None, None]
+
+
+def test_repair():
+    stats = reconcile(Item, mode='repair', batch_size=4)
+    assert (stats['drifted'], stats['fixed']) == (2, 2)
+    assert _names(range(1, 5)) == ['item1', 'item2', 'item3', 'item4']
+
+
+def test_repair_evicts_rows_changed_meanwhile():
+    mget = Item._cache_client.mget
+
+    def update_then_mget(keys):
+        keys = list(keys)
+        if len(keys) == 4 and not update_then_mget.done:
+            update_then_mget.done = True
+            # row 2 committed and cached, row 4 committed, not yet cached
+            memory_engine.execute(Item.__table__.update().where(
+                Item.id.in_([2, 4])).values(name='new'))
+            Item._cache_client.set(Item.gen_raw_key(2), {
+                'id': 2, 'name': 'new', 'group': 0, 'updated': 2})
+        return mget(keys)
+    update_then_mget.done = False
+
+    with mock.patch.object(Item._cache_client, 'mget',
+                           side_effect=update_then_mget), \
+            mock.patch.object(Item, 'mset') as mset:
+        stats = reconcile(Item, mode='repair', batch_size=4)
+    assert not mset.called
+    assert stats['fixed'] == 1
+    assert _names([2, 4]) == ['new', None]
+
+
+def test_transaction_ended_per_batch():
+    session = MemorySession()
+    with mock.patch.object(session, 'close', wraps=session.close) as close:
+        reconcile(Item, batch_size=4)
+    # after each of the 3 batches and once at the end
+    assert close.call_count == 4
+    assert not session.transaction._connections
+
+
+def test_reads_from_master():
+    session = MemorySession()
+    using_bind = session.using_bind = mock.Mock()
+    session._name = 'slave'
+    try:
+        reconcile(Item)
+    finally:
+        del session.using_bind, session._name
+    assert using_bind.call_args_list == \
+        [mock.call('master'), mock.call('slave')]
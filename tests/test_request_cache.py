@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import pytest
+from dogpile.cache.region import make_region
+from flask import Flask, g
+from flask_sqlalchemy import SQLAlchemy
+
+from ecache.ext import request_cache
+from ecache.ext.flask_cache import CacheableMixin, FromCache, query_callable
+
+
+regions = dict(default=make_region().configure('dogpile.cache.memory_pickle'))
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db = SQLAlchemy(app)
+request_cache.init_app(app)
+
+
+class Item(db.Model, CacheableMixin):
+    cache_regions = regions
+    query_class = query_callable(regions)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(32))
+    group = db.Column(db.Integer)
+
+
+@pytest.fixture
+def items():
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(Item(id=i, name='item%d' % i, group=i % 2)
+                           for i in range(1, 5))
+        db.session.commit()
+        regions['default'].backend._cache.clear()
+        yield request_cache.current()
+        db.session.remove()
+        db.drop_all()
+
+
+def test_init_app():
+    assert app.extensions[request_cache._EXTENSION_NAME]
+    assert request_cache._teardown in app.teardown_appcontext_funcs
+    assert request_cache.current() is None
+
+    other = Flask(__name__)
+    with other.app_context():
+        assert request_cache.current() is None
+    with app.app_context():
+        memo = request_cache.current()
+        assert isinstance(memo, request_cache.RequestCache)
+        assert request_cache.current() is memo
+
+
+def test_memo_hits(items):
+    region = regions['default']
+    query = Item.query.options(FromCache()).filter(Item.group == 1)
+    with mock.patch.object(region, 'get_multi',
+                           wraps=region.get_multi) as get_multi, \
+            mock.patch.object(region, 'get_or_create',
+                              wraps=region.get_or_create) as get_or_create:
+        for _ in range(3):
+            assert Item.cache.get(2).name == 'item2'
+            assert [i.id for i in Item.cache.filter(group=0)] == [2, 4]
+            assert [i.id for i in query] == [1, 3]
+
+    # one lookup each for Cache.get and the query, versions of the query
+    # tables and pks of the filter
+    assert get_or_create.call_count == 2
+    assert get_multi.call_count == 2
+    assert items.hits == 6
+
+
+def test_invalidate_after_commit(items):
+    query = Item.query.options(FromCache()).filter(Item.group == 1)
+    assert Item.cache.get(1).name == 'item1'
+    assert [i.name for i in query] == ['item1', 'item3']
+    assert [i.name for i in Item.cache.filter(group=1)] == ['item1', 'item3']
+
+    Item.query.get(1).name = 'changed'
+    db.session.commit()
+
+    assert Item.cache.get(1).name == 'changed'
+    assert [i.name for i in query] == ['changed', 'item3']
+    assert [i.name for i in Item.cache.filter(group=1)] == \
+        ['changed', 'item3']
+    assert items.invalidations >= 1
+
+
+def test_teardown_clears_g():
+    with app.app_context():
+        memo = request_cache.current()
+        memo.get('item', 'key')
+        with mock.patch.object(request_cache, 'logger') as logger:
+            app.do_teardown_appcontext()
+        assert getattr(g, request_cache._G_ATTR, None) is None
+        logger.debug.assert_called_once_with(mock.ANY, memo.summary())
+        assert request_cache.current() is not memo
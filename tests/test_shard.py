@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os
+import signal
+
+from ecache.shard import HashRing, ShardedCacheClient
+
+
+class DictClient(object):
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def set(self, key, val, expiration_time=None):
+        self.data[key] = val
+        return True
+
+    def mset(self, mapping, expiration_time=None):
+        self.data.update(mapping)
+        return True
+
+    def delete(self, *keys):
+        return sum(1 for k in keys if self.data.pop(k, None) is not None)
+
+
+def _client(n):
+    return ShardedCacheClient(
+        {'node%d' % i: DictClient() for i in range(n)})
+
+
+def test_keys_spread_across_nodes():
+    cache = _client(4)
+    cache.mset({"user|%d" % i: i for i in range(1000)})
+
+    sizes = [len(c.data) for c in cache.nodes.values()]
+    assert sum(sizes) == 1000
+    assert min(sizes) > 150
+
+
+def test_mget_keeps_order():
+    cache = _client(3)
+    cache.mset({"user|%d" % i: i for i in range(100)})
+    keys = ["user|%d" % i for i in (5, 99, 1000, 3, 42)]
+
+    assert cache.mget(keys) == [5, 99, None, 3, 42]
+    assert cache.mget(iter(keys[:2])) == [5, 99]
+
+
+def test_get_set_delete():
+    cache = _client(3)
+    cache.set("user|1", {"id": 1}, 60)
+
+    assert cache.get("user|1") == {"id": 1}
+    assert cache.delete("user|1", "user|2") == 1
+    assert cache.get("user|1") is None
+
+
+def test_node_change_moves_few_keys():
+    keys = ["user|%d" % i for i in range(10000)]
+    ring = HashRing(['node%d' % i for i in range(4)])
+    before = {k: ring.get_node(k) for k in keys}
+
+    ring.add_node('node4')
+    moved = [k for k in keys if ring.get_node(k) != before[k]]
+    assert all(ring.get_node(k) == 'node4' for k in moved)
+    assert len(moved) < len(keys) * 0.3
+
+    ring.remove_node('node4')
+    assert all(ring.get_node(k) == before[k] for k in keys)
+
+
+def test_pool_recreated_after_fork():
+    cache = _client(3)
+    cache.mset({"user|%d" % i: i for i in range(10)})
+    parent_pool = cache._get_pool()
+
+    pid = os.fork()
+    if pid == 0:
+        # a hanging pool map is killed by the alarm
+        signal.alarm(5)
+        ok = cache.mget(["user|1", "user|2", "user|3"]) == [1, 2, 3] and \
+            cache._pool is not parent_pool
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+    assert cache._get_pool() is parent_pool
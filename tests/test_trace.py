@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+from ecache.trace import OP_GET, OP_SET, Record, TraceRecorder, \
+    read_trace, simulate
+
+
+def test_record_and_read(tmpdir):
+    path = str(tmpdir.join('ecache.trace'))
+    recorder = TraceRecorder(path)
+    recorder.record('user', 'get', [1, 2], [True, False])
+    recorder.record('user', 'set', [2])
+    recorder.record('order', 'flush', ['a1'])
+    recorder.close()
+
+    sample_rate, records = read_trace(path)
+    records = list(records)
+    assert sample_rate == 1.0
+    assert [(r.table, r.op, r.hit) for r in records] == [
+        ('user', 1, 1), ('user', 1, 0), ('user', 2, 2), ('order', 3, 2)]
+    assert records[0].key == 1
+
+
+def test_sampling_by_key(tmpdir):
+    path = str(tmpdir.join('ecache.trace'))
+    recorder = TraceRecorder(path, sample_rate=0.5)
+    for _ in range(3):
+        recorder.record('user', 'get', list(range(1000)), True)
+    recorder.close()
+
+    _, records = read_trace(path)
+    keys = [r.key for r in records]
+    assert 300 < len(set(keys)) < 700
+    assert len(keys) == 3 * len(set(keys))
+
+
+def test_simulate():
+    records = [Record(float(i), 'user', OP_GET, pk, 0)
+               for i, pk in enumerate([1, 2, 1, 3, 1, 2])]
+
+    lru = simulate(records, capacity=2, policy='lru')
+    assert (lru['gets'], lru['hit_ratio']) == (6, 2.0 / 6)
+    assert lru['db_loads'] == 4
+
+    big = simulate(records, capacity=10)
+    assert big['hit_ratio'] == 0.5
+
+    expiring = simulate(records, capacity=10, ttl=1.5)
+    assert expiring['hit_ratio'] == 0
+
+
+def test_simulate_skips_recorded_fill():
+    records = [Record(0, 'user', OP_GET, 1, 0),
+               Record(0, 'user', OP_SET, 1, 2),
+               Record(1, 'user', OP_GET, 1, 1)]
+    report = simulate(records, capacity=1, policy='lfu')
+    assert report['hit_ratio'] == 0.5
+    assert report['recorded_hit_ratio'] == 0.5
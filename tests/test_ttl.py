@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import mock
+
+from ecache.ttl import AdaptiveTTL
+
+
+def test_cold_key_gets_min_ttl():
+    policy = AdaptiveTTL(min_ttl=60, max_ttl=3600)
+    assert policy.ttl(1) == 60
+
+
+def test_hot_key_gets_longer_ttl():
+    policy = AdaptiveTTL(min_ttl=60, max_ttl=3600, half_heat=10)
+    for _ in range(1000):
+        policy.record_reads([1])
+
+    assert policy.ttl(1) == 3600
+
+
+def test_churny_key_gets_shorter_ttl():
+    policy = AdaptiveTTL(min_ttl=60, max_ttl=3600)
+    for _ in range(100):
+        policy.record_reads([1, 2])
+    policy.record_writes([2] * 50)
+
+    assert policy.ttl(2) < policy.ttl(1)
+
+
+def test_counters_decay():
+    policy = AdaptiveTTL(min_ttl=60, max_ttl=3600, window=10)
+    with mock.patch('time.time', return_value=policy._decay_at - 1):
+        policy.record_reads([1] * 4)
+    with mock.patch('time.time', return_value=policy._decay_at + 1):
+        policy.record_reads([2])
+
+    assert policy.counters[1] == [2, 0]